@@ -95,9 +95,11 @@ class Table:
         # Returns the child table that are not the current table
         return {x for x in self.child_tables if x.full_name != self.full_name and not x.ignore}
 
-    @property
+    # Cached and interned, used as a key to look the tables up
+    # (the tables are hashed on it along with `has_been_processed`)
+    @functools.cached_property
     def full_name(self):
-        return _get_full_name(self.schema, self.table)
+        return sys.intern(_get_full_name(self.schema, self.table))
 
     @property
     def tmp_name(self):
@@ -126,15 +128,21 @@ class Table:
         self._count = v
 
     def get_values(self, table: str | None = None):
-        if self.columns is None:
-            raise ValueError("Columns must be loaded first")
         _table = f"{table}." if table is not None else ""
-        return ", ".join(sorted([f'{_table}"{x.name}"' for x in self.columns if not x.is_generated]))
+        return ", ".join(f'{_table}"{x}"' for x in self.column_names)
 
-    @property
+    # Cached, columns are not expected to change once loaded
+    @functools.cached_property
     def values(self):
         return self.get_values()
 
+    @functools.cached_property
+    def column_names(self) -> list[str]:
+        """Non generated column names, in the same order as `values`"""
+        if self.columns is None:
+            raise ValueError("Columns must be loaded first")
+        return sorted((x.name for x in self.columns if not x.is_generated), key=lambda x: f'"{x}"')
+
     @property
     def is_leaf(self):
         return not self.has_children and self.has_parent
@@ -8,11 +8,20 @@ PG_PORT = int(os.getenv("PG_PORT", "5432"))
 PG_USER = os.getenv("PG_USER", "postgres")
 PG_PASSWORD = os.getenv("PG_PASSWORD", "postgres")
 
+# Sampling
+# Maximum number of connections used to insert the sampled tables concurrently
+SAMPLE_POOL_SIZE = int(os.getenv("SAMPLE_POOL_SIZE", "8"))
+
 # Migration
 SQL_DIR = os.getenv("SQL_DIR")
 MIGRATION_DIR = os.getenv("MIGRATION_DIR")
 
-_PADMY_FOLDER = Path(os.getenv("PADMY_FOLDER", Path.home() / ".padmy"))
+
+def get_padmy_folder() -> Path:
+    return Path(os.getenv("PADMY_FOLDER", Path.home() / ".padmy"))
+
+
+_PADMY_FOLDER = get_padmy_folder()
 PADMY_CONFIG = _PADMY_FOLDER / "config.json"
 
 
@@ -63,13 +63,22 @@ def compare_files(file1: Path, file2: Path) -> Iterator[str] | None:
     return diff
 
 
+def compare_dumps(before: str, after: str, *, fromfile: str = "", tofile: str = "") -> Iterator[str] | None:
+    """
+    Compares 2 dumps held in memory. If they are the same, returns None, otherwise returns the diff
+    """
+    if before == after:
+        return None
+    return difflib.unified_diff(before.split("\n"), after.split("\n"), fromfile=fromfile, tofile=tofile)
+
+
 def _verify_migration(
     database: str,
     schemas: list[str],
     migration_id: str,
     up_file: Path,
     down_file: Path,
-    dump_dir: Path,
+    dump_dir: Path | None = None,
     *,
     compare_files_fn: CompareFilesFn = compare_files,
 ):
@@ -77,13 +86,14 @@ def _verify_migration(
         f"{migration_id}-before.sql",
         f"{migration_id}-after.sql",
     )
+    _options = ["-E", "utf8", "--schema-only"]
 
     # Dump before
-    pg_dump(
+    _before = pg_dump(
         database,
         schemas,
-        dump_path=str(dump_dir / _before_dump),
-        options=["-E", "utf8", "--schema-only"],
+        dump_path=str(dump_dir / _before_dump) if dump_dir is not None else None,
+        options=_options,
     )
 
     logs.info(f"Applying {up_file.name}")
@@ -93,19 +103,18 @@ def _verify_migration(
     exec_psql_file(database, str(down_file))
 
     # Dump after
-    pg_dump(
+    _after = pg_dump(
         database,
         schemas,
-        dump_path=str(dump_dir / _after_dump),
-        options=["-E", "utf8", "--schema-only"],
-    )
-
-    _before_dump_file, _after_dump_file = (
-        dump_dir / _before_dump,
-        dump_dir / _after_dump,
+        dump_path=str(dump_dir / _after_dump) if dump_dir is not None else None,
+        options=_options,
     )
 
-    _diff = compare_files_fn(_before_dump_file, _after_dump_file)
+    if dump_dir is None:
+        # The dumps have been streamed to memory, no need to write them to disk
+        _diff = compare_dumps(_before or "", _after or "", fromfile=_before_dump, tofile=_after_dump)
+    else:
+        _diff = compare_files_fn(dump_dir / _before_dump, dump_dir / _after_dump)
     if _diff is not None:
         raise MigrationError(f"Difference found for migration: {migration_id}", diff="\n".join(_diff))
 
@@ -113,14 +122,16 @@ def _verify_migration(
 def migrate_verify(
     database: str,
     schemas: list[str],
-    dump_dir: Path,
+    dump_dir: Path | None,
     migration_folder: Path,
     *,
     only_last: bool = False,
     compare_files_fn: CompareFilesFn = compare_files,
 ):
     """
-    Verifies that the up/down migration is correct
+    Verifies that the up/down migration is correct.
+    If `dump_dir` is None, the dumps are compared in memory without being written to disk
+    (`compare_files_fn` is then not used).
     """
     _pg_dump = functools.partial(pg_dump, database=database, schemas=schemas)
 
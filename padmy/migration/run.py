@@ -1,6 +1,5 @@
 import os
 import shutil
-import tempfile
 from pathlib import Path
 
 from asyncpg import Connection
@@ -119,13 +118,12 @@ def migrate_verify_main(
     from .migration import migrate_verify, MigrationError
 
     try:
-        with tempfile.TemporaryDirectory() as dump_dir:
-            migrate_verify(
-                database=db,
-                migration_folder=sql_dir,
-                schemas=schemas,
-                dump_dir=Path(dump_dir),
-            )
+        migrate_verify(
+            database=db,
+            migration_folder=sql_dir,
+            schemas=schemas,
+            dump_dir=None,
+        )
     except MigrationError as e:
         logs.error(e.msg)
         logs.debug(e.diff)
@@ -135,16 +133,29 @@ def migrate_verify_main(
 def verify_files(
     sql_dir: Path = MigrationDir,
     no_raise_error: bool = Option(False, "--no-raise", help="Raise an error if the files are not correctly ordered"),
+    no_cache: bool = Option(False, "--no-cache", help="Verify the files even if they did not change"),
 ):
     from .utils import verify_migration_files
 
-    has_errors = verify_migration_files(sql_dir, raise_error=not no_raise_error)
+    has_errors = verify_migration_files(sql_dir, raise_error=not no_raise_error, use_cache=not no_cache)
     if has_errors:
         raise CommandError("Files are not correctly ordered")
     else:
         CONSOLE.print("[green]Files are correctly ordered[/green]")
 
 
+def _link_or_copy(src: str, dst: str):
+    """
+    Hardlinks `src` to `dst`, falling back to a copy if both are not on the same filesystem.
+    Files are only renamed or replaced (never written in place) when reordering,
+    so the original files are left untouched.
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
 @migration.command(cmd="reorder-files", help="Reorder the files")
 def reorder_files(
     migrations_dir: Path = MigrationDir,
@@ -157,11 +168,11 @@ def reorder_files(
     from .utils import verify_migration_files
 
     folder = migrations_dir
-    # Creating the output dir
-    if output_dir is not None:
+    # Creating the output dir (nothing to copy when reordering in place)
+    if output_dir is not None and output_dir.resolve() != migrations_dir.resolve():
         if output_dir.exists():
             shutil.rmtree(output_dir)
-        shutil.copytree(migrations_dir, output_dir)
+        shutil.copytree(migrations_dir, output_dir, copy_function=_link_or_copy)
         folder = output_dir
 
     reorder_files(folder, last_migration_ids=last_migration_ids or [])
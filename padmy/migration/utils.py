@@ -8,10 +8,16 @@ else:
     from pytz import UTC
 
 import dataclasses
-import textwrap
-from itertools import groupby
+import functools
+import hashlib
+import json
+import os
+import re
+import typing
+from concurrent.futures import ThreadPoolExecutor
 from operator import attrgetter
 from pathlib import Path
+from padmy.env import get_padmy_folder
 from padmy.logs import logs
 
 from padmy.utils import exec_cmd
@@ -22,15 +28,40 @@ __all__ = (
     "get_files",
     "iter_migration_files",
     "verify_migration_files",
+    "MigrationFileError",
     "get_git_email",
     "utc_now",
 )
 
 
+class MigrationFileError(ValueError):
+    def __init__(self, errors: list[str]):
+        super().__init__("\n".join(errors))
+        self.errors = errors
+
+
 def get_git_email():
     return exec_cmd(["git", "config", "user.email"]).strip()
 
 
+_HEADER_REG = re.compile(rb"^-- (?P<field>Prev-file|Author|Version):(?P<value>.*)$", flags=re.MULTILINE)
+_HEADER_FIELDS = {b"Prev-file": "prev_file", b"Author": "author", b"Version": "version"}
+# Lines at the top of the file starting with this prefix make up the header
+_HEADER_LINE_PREFIX = b"-- "
+
+
+def _read_header_bytes(path: Path) -> bytes:
+    """
+    Reads the comment lines at the top of the file, where the header is,
+    without loading the rest of the file
+    """
+    lines = []
+    with path.open("rb") as f:
+        while (line := f.readline()).startswith(_HEADER_LINE_PREFIX):
+            lines.append(line)
+    return b"".join(lines)
+
+
 @dataclasses.dataclass
 class Header:
     prev_file: str | None
@@ -42,18 +73,13 @@ class Header:
         return not any([self.prev_file, self.author, self.version])
 
     @classmethod
-    def from_text(cls, text: str):
-        prev_file = None
-        author = None
-        version = None
-        for line in text.split("\n"):
-            if line.startswith("-- Prev-file:"):
-                prev_file = line.split(":")[1].strip()
-            elif line.startswith("-- Author:"):
-                author = line.split(":")[1].strip()
-            elif line.startswith("-- Version:"):
-                version = line.split(":")[1].strip()
-        return cls(prev_file, author, version)
+    def from_text(cls, text: str | bytes):
+        # Working on bytes, only the header values are decoded
+        data = text.encode("utf-8") if isinstance(text, str) else text
+        fields: dict[str, str | None] = {"prev_file": None, "author": None, "version": None}
+        for _match in _HEADER_REG.finditer(data):
+            fields[_HEADER_FIELDS[_match.group("field")]] = _match.group("value").decode("utf-8").strip()
+        return cls(**fields)
 
     def as_text(self):
         _header = [
@@ -63,38 +89,82 @@ class Header:
         if self.version is not None:
             _header.append(f"-- Version: {self.version}")
 
-        file_header = textwrap.dedent("\n".join(_header)).strip()
-        return file_header
+        return "\n".join(_header).strip()
 
 
-@dataclasses.dataclass
+class _NotLoaded:
+    pass
+
+
+_NOT_LOADED = _NotLoaded()
+
+
+@dataclasses.dataclass(init=False)
 class MigrationFile:
     ts: dt.datetime
     file_id: str
     file_type: str
     path: Path
-    header: Header | None = None
+    _header: Header | None | _NotLoaded = dataclasses.field(repr=False, compare=False)
+    _ts_int: int = dataclasses.field(repr=False, compare=False)
+    # Stat of the file when it was listed, saves a syscall when loading the header
+    _stat: os.stat_result | None = dataclasses.field(repr=False, compare=False)
+
+    def __init__(
+        self,
+        ts: dt.datetime,
+        file_id: str,
+        file_type: str,
+        path: Path,
+        header: Header | None | _NotLoaded = None,
+        *,
+        stat: os.stat_result | None = None,
+    ):
+        self.ts = ts
+        self._ts_int = int(ts.timestamp())
+        self.file_id = file_id
+        self.file_type = file_type
+        self.path = path
+        self._header = header
+        self._stat = stat
+
+    @property
+    def header(self) -> Header | None:
+        """The header is only read from the file when first accessed"""
+        if isinstance(self._header, _NotLoaded):
+            self._header = _load_header(self.path, stat=self._stat)
+        return self._header
+
+    @header.setter
+    def header(self, header: Header | None):
+        self._header = header
 
     @property
     def name(self):
-        return f"{int(self.ts.timestamp())}-{self.file_id}-{self.file_type}.sql"
+        return f"{self._ts_int}-{self.file_id}-{self.file_type}.sql"
 
     def replace_ts(self, ts: dt.datetime):
         self.ts = ts
+        self._ts_int = int(ts.timestamp())
         new_path = self.path.with_name(self.name)
         self.path = self.path.rename(new_path)
 
     def write_header(self):
         if not self.header:
             return
-        # Remove the first lines starting with --
-        if self.path.exists():
-            lines = [_line for _line in self.path.read_text().split("\n") if not _line.startswith("-- ")]
-            _lines = "\n" + "\n".join(lines)
-        else:
-            _lines = "\n"
-        new_text = self.header.as_text() + _lines
-        self.path.write_text(new_text)
+        # Skipping the first lines starting with -- (the previous header)
+        try:
+            with self.path.open("rb") as f:
+                while (line := f.readline()).startswith(_HEADER_LINE_PREFIX):
+                    pass
+                _body = line + f.read()
+        except FileNotFoundError:
+            _body = b""
+        # Writing to a new file and replacing the old one, so hardlinked copies are not modified
+        _tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        _tmp_path.write_bytes(self.header.as_text().encode("utf-8") + b"\n" + _body)
+        _tmp_path.replace(self.path)
+        self._stat = None
 
     @staticmethod
     def generate_base_name(ts: int | None = None, file_id: str | None = None) -> str:
@@ -107,106 +177,238 @@ class MigrationFile:
         return f"{_ts}-{_file_id}"
 
     @classmethod
-    def from_file(cls, path: Path):
-        filename_infos = parse_filename(path.name)
-        header = Header.from_text(path.read_text())
+    def from_file(cls, path: Path, *, stat: os.stat_result | None = None):
+        filename_infos = _parse_filename(path.name)
         return cls(
-            ts=filename_infos["file_ts"],
-            file_id=filename_infos["file_id"],
-            file_type=filename_infos["migration_type"],
+            ts=filename_infos.file_ts,
+            file_id=filename_infos.file_id,
+            file_type=filename_infos.migration_type,
             path=path,
-            header=header if not header.is_empty else None,
+            header=_NOT_LOADED,
+            stat=stat,
         )
 
 
-def parse_filename(filename: str) -> dict:
+# Parsed headers by (path, mtime, size), a file is parsed again as soon as it changes
+_HEADERS_CACHE: dict[tuple[str, int, int], Header | None] = {}
+
+
+def _load_header(path: Path, *, stat: os.stat_result | None = None) -> Header | None:
+    _stat = stat or path.stat()
+    key = (str(path), _stat.st_mtime_ns, _stat.st_size)
+    if key not in _HEADERS_CACHE:
+        header = Header.from_text(_read_header_bytes(path))
+        _HEADERS_CACHE[key] = header if not header.is_empty else None
+    header = _HEADERS_CACHE[key]
+    # Headers can be modified by the caller (see `rename_files`), so a copy is returned
+    return dataclasses.replace(header) if header is not None else None
+
+
+class FilenameInfos(typing.NamedTuple):
+    file_ts: dt.datetime
+    file_id: str
+    migration_type: str
+
+
+# Timestamps are stored as naive UTC datetimes
+_EPOCH = dt.datetime(1970, 1, 1)
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_filename(filename: str) -> FilenameInfos:
     ts, file_id, file_type = filename.split("-")
-    infos = {
-        "file_ts": dt.datetime.fromtimestamp(int(ts), tz=UTC).replace(tzinfo=None),
-        "file_id": file_id,
-        "migration_type": file_type.replace(".sql", ""),
-    }
-    return infos
+    return FilenameInfos(
+        file_ts=_EPOCH + dt.timedelta(seconds=int(ts)),
+        file_id=file_id,
+        migration_type=file_type.replace(".sql", ""),
+    )
+
+
+def parse_filename(filename: str) -> dict:
+    return _parse_filename(filename)._asdict()
 
 
-def get_files(folder: Path, reverse: bool = False, up_only: bool = False) -> list[MigrationFile]:
-    """Returns the migration files in ascending order"""
-    files = []
-    pattern = "*.sql" if not up_only else "*-up.sql"
-    for file in folder.glob(pattern):
-        files.append(MigrationFile.from_file(file))
+def get_files(
+    folder: Path,
+    reverse: bool = False,
+    up_only: bool = False,
+    *,
+    load_headers: bool = False,
+) -> list[MigrationFile]:
+    """
+    Returns the migration files in ascending order.
+    Headers are read when first accessed, unless `load_headers` is set.
+    """
+    suffix = "-up.sql" if up_only else ".sql"
+    # `os.scandir` yields entries with a cached file type, avoiding a stat per file
+    with os.scandir(folder) as it:
+        entries = [entry for entry in it if entry.name.endswith(suffix) and entry.is_file()]
+    # Sorting on the names before creating the files
+    entries.sort(key=lambda entry: _filename_sort_key(entry.name), reverse=reverse)
+    if not load_headers:
+        return [MigrationFile.from_file(folder / entry.name) for entry in entries]
 
-    return sorted(files, key=attrgetter("ts", "file_id"), reverse=reverse)
+    # The headers are needed, the stats are taken from the directory listing
+    files = [MigrationFile.from_file(folder / entry.name, stat=entry.stat()) for entry in entries]
+    _load_headers(files)
+    return files
 
 
-def iter_migration_files(files: list[MigrationFile]):
-    for _file_id, _files_it in groupby(files, lambda x: x.file_id):
-        _files: list[MigrationFile] = list(_files_it)
+# Under this number of files, reading the headers sequentially is faster than starting threads
+_THREADED_HEADERS_MIN_FILES = 16
 
-        _up_files = [x for x in _files if x.file_type == "up"]
-        _down_files = [x for x in _files if x.file_type == "down"]
 
-        if len(_up_files) != 1:
-            raise ValueError(
-                f'Found {len(_up_files)} "up" files (file_id: {_up_files[0].file_id})'
-                if _up_files
-                else "No up file found"
-            )
-        if len(_down_files) != 1:
-            raise ValueError(
-                f'Found {len(_down_files)} "down" files (file_id: {_down_files[0].file_id})'
-                if _down_files
-                else "No down file found"
-            )
+def _load_headers(files: list[MigrationFile]):
+    """Reads the headers of the files concurrently"""
+    # Accessing the header loads it
+    if len(files) < _THREADED_HEADERS_MIN_FILES:
+        for _file in files:
+            _ = _file.header
+        return
+
+    with ThreadPoolExecutor(max_workers=min(32, len(files))) as executor:
+        list(executor.map(attrgetter("header"), files))
+
+
+def _filename_sort_key(filename: str) -> tuple[int, str]:
+    """Filenames are formatted as `{ts}-{file_id}-{file_type}.sql`"""
+    ts, _, _ = filename.partition("-")
+    return int(ts), filename
+
+
+_FILE_TYPE_INDEX = {"up": 0, "down": 1}
+
+
+def iter_migration_files(files: list[MigrationFile], *, errors: list[str] | None = None):
+    """
+    Yields the (up, down) files for each migration, in the order
+    the migrations first appear in `files`.
+    Invalid migrations (duplicate or missing files) raise a `ValueError`, unless `errors`
+    is given: the errors are then appended to it and the invalid migrations are skipped.
+    """
+
+    def _on_error(msg: str):
+        if errors is None:
+            raise ValueError(msg)
+        errors.append(msg)
+
+    # Grouping in a dict does not require files with the same `file_id` to be adjacent
+    groups: dict[str, list[MigrationFile | None]] = {}
+    _invalid_ids: set[str] = set()
+    for _file in files:
+        _index = _FILE_TYPE_INDEX.get(_file.file_type)
+        if _index is None:
+            continue
+        _group = groups.setdefault(_file.file_id, [None, None])
+        if _group[_index] is not None:
+            _on_error(f'Found multiple "{_file.file_type}" files (file_id: {_file.file_id})')
+            _invalid_ids.add(_file.file_id)
+            continue
+        _group[_index] = _file
 
-        yield _up_files[0], _down_files[0]
+    for _file_id, (_up_file, _down_file) in groups.items():
+        if _up_file is None:
+            _on_error(f"No up file found (file_id: {_file_id})")
+        elif _down_file is None:
+            _on_error(f"No down file found (file_id: {_file_id})")
+        elif _file_id not in _invalid_ids:
+            yield _up_file, _down_file
 
 
-def verify_migration_files(migration_dir: Path, *, raise_error: bool = True):
+def _get_dir_digest(folder: Path) -> str:
+    """Digest of the names, modification times and sizes of the migration files"""
+    with os.scandir(folder) as it:
+        entries = sorted((entry for entry in it if entry.name.endswith(".sql")), key=attrgetter("name"))
+    _hash = hashlib.blake2b(digest_size=16)
+    for entry in entries:
+        _stat = entry.stat()
+        _hash.update(f"{entry.name}:{_stat.st_mtime_ns}:{_stat.st_size}\n".encode("utf-8"))
+    return _hash.hexdigest()
+
+
+def _get_verify_cache_path() -> Path:
+    """
+    Digests of the migration directories that have been successfully verified.
+    Resolved on each call, so that changes to PADMY_FOLDER are taken into account.
+    """
+    return get_padmy_folder() / "verify-cache.json"
+
+
+def _load_verify_cache() -> dict[str, str]:
+    _path = _get_verify_cache_path()
+    if not _path.exists():
+        return {}
+    try:
+        return json.loads(_path.read_text())
+    except json.JSONDecodeError:
+        return {}
+
+
+def _save_verify_cache(cache: dict[str, str]):
+    _path = _get_verify_cache_path()
+    if not _path.parent.exists():
+        _path.parent.mkdir(parents=True)
+    with _path.open("w") as f:
+        json.dump(cache, f, indent=4)
+
+
+def verify_migration_files(migration_dir: Path, *, raise_error: bool = True, use_cache: bool = False):
     """
     Verifies that the migration files are in order.
+    All the errors are collected and reported at once.
+    If `use_cache` is set, the verification is skipped when the files did not change
+    since the last successful verification (the digests are stored in the padmy folder).
     """
+    _cache_key, _digest, _cache = "", "", {}
+    if use_cache:
+        _cache_key, _digest = str(migration_dir.resolve()), _get_dir_digest(migration_dir)
+        _cache = _load_verify_cache()
+        if _cache.get(_cache_key) == _digest:
+            logs.info("Migration files unchanged since the last verification, skipping")
+            return False
+
     prev_files = None
-    has_errors = False
-    _ids = set()
-    for _file in iter_migration_files(get_files(migration_dir)):
+    errors: list[str] = []
+    for _file in iter_migration_files(get_files(migration_dir, load_headers=True), errors=errors):
         if prev_files is None:
             prev_files = _file
             continue
         prev_up, prev_down = prev_files
         up, down = _file
 
-        if up.file_id in _ids:
-            raise ValueError(f"Duplicate file id {up.file_id}")
-        _ids.add(up.file_id)
+        _file_errors = []
+        if prev_up.ts > up.ts:
+            _file_errors.append(f"Files are not in order: {prev_up.path.name} > {up.path.name}")
+        if prev_down.ts > down.ts:
+            _file_errors.append(f"Files are not in order: {prev_down.path.name} > {down.path.name}")
 
-        try:
-            if prev_up.ts > up.ts:
-                raise ValueError(f"Files are not in order: {prev_up.path.name} > {up.path.name}")
-            if prev_down.ts > down.ts:
-                raise ValueError(f"Files are not in order: {prev_down.path.name} > {down.path.name}")
-
-            if up.header is not None and up.header.prev_file != prev_up.path.name:
-                raise ValueError(
-                    f"Invalid header for up file {up.path.name} : "
-                    f"(expected {prev_up.path.name!r} got {up.header.prev_file!r})"
-                )
-            if down.header is not None and down.header.prev_file != prev_down.path.name:
-                raise ValueError(
-                    f"Invalid header for down file {down.path.name} : "
-                    f"(expected {prev_down.path.name!r} got {down.header.prev_file!r})"
-                )
-        except ValueError as e:
-            if raise_error:
-                raise e
-            logs.warning(e.args[0])
-            has_errors = True
+        if up.header is not None and up.header.prev_file != prev_up.path.name:
+            _file_errors.append(
+                f"Invalid header for up file {up.path.name} : "
+                f"(expected {prev_up.path.name!r} got {up.header.prev_file!r})"
+            )
+        if down.header is not None and down.header.prev_file != prev_down.path.name:
+            _file_errors.append(
+                f"Invalid header for down file {down.path.name} : "
+                f"(expected {prev_down.path.name!r} got {down.header.prev_file!r})"
+            )
+
+        if _file_errors:
+            errors += _file_errors
         else:
             logs.info(f"Valid header for file {up.path.name}")
 
         prev_files = _file
 
-    return has_errors
+    if errors:
+        if raise_error:
+            raise MigrationFileError(errors)
+        logs.warning("\n".join(errors))
+    elif use_cache:
+        _cache[_cache_key] = _digest
+        _save_verify_cache(_cache)
+
+    return len(errors) > 0
 
 
 def utc_now():
@@ -1,3 +1,5 @@
+import sys
+
 from padmy.logs import logs
 
 try:
@@ -6,30 +8,25 @@ except ImportError:
     logs.error("Please install networkx to use this module")
     raise
 
-from ..db import Database, Table
-
-
-def add_nodes(graph: nx.Graph, table: Table, processed_nodes: set[str]):
-    if table.full_name in processed_nodes:
-        return
+from ..db import Database
 
-    graph.add_node(table.full_name.replace(".", "_"), count=table.count, label=table.full_name)
 
-    processed_nodes.add(table.full_name)
-
-    for _child_table in table.child_tables:
-        graph.add_edge(
-            table.full_name.replace(".", "_"),
-            _child_table.full_name.replace(".", "_"),
-        )
-        add_nodes(graph, _child_table, processed_nodes)
+def _get_node_name(full_name: str) -> str:
+    return sys.intern(full_name.replace(".", "_"))
 
 
 def convert_db(db: Database) -> nx.DiGraph:
-    g = nx.DiGraph()
-    processed_nodes = set()
+    # Node name for each table full name, interned as they are concatenated into the edge ids
+    names = {table.full_name: _get_node_name(table.full_name) for table in db.tables}
 
-    for table in db.tables:
-        add_nodes(g, table, processed_nodes)
+    nodes = [(names[table.full_name], {"count": table.count, "label": table.full_name}) for table in db.tables]
+    edges = [
+        (names[table.full_name], names.get(_child_table.full_name) or _get_node_name(_child_table.full_name))
+        for table in db.tables
+        for _child_table in table.child_tables
+    ]
 
+    g = nx.DiGraph()
+    g.add_nodes_from(nodes)
+    g.add_edges_from(edges)
     return g
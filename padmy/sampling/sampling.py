@@ -1,16 +1,23 @@
+import asyncio
+import collections
 import contextlib
+import logging
 import tempfile
 from math import floor
-from typing import cast, Literal
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, Literal, cast
 
 import asyncpg
 from rich.progress import Progress
-from tracktolib.pg import insert_many, iterate_pg
 
-from ..db import Database, Table, FKConstraint
+from ..db import Database, Table
 from ..logs import logs
 from ..utils import (
     check_cmd,
+    get_pg_dump_cmd,
+    get_pg_envs,
+    get_pg_restore_cmd,
+    pg_dump_restore,
     pg_restore,
     pg_dump,
     create_db,
@@ -19,9 +26,17 @@ from ..utils import (
     check_extension_exists,
     parse_pg_uri,
     temp_env,
+    PGError,
 )
 
 
+_COPY_DATABASE_CMDS = ("pg_dump", "createdb", "dropdb", "pg_restore", "psql")
+
+
+def _raise_pg_error(msg: str):
+    raise PGError(msg)
+
+
 def copy_database(
     from_pg_uri: str,
     from_db: str,
@@ -29,39 +44,35 @@ def copy_database(
     to_db: str,
     schemas: list[str],
     drop_public: bool = False,
+    *,
+    jobs: int = 1,
+    compression: int = 0,
 ):
     """
     Dumps and recreate the schemas from `from_db` into `to_db`.
     You can optionally specify `drop_public` to drop the public schema
     before restoring and avoid ' ERROR:  schema "public" already exists'
     (useful if you have *public* specified in your schemas list)
+    With a single job (the default), pg_dump is piped into pg_restore and nothing is written to disk.
+    The target database is then recreated before the dump starts: the source is checked to be
+    reachable first, but if the dump still fails, `to_db` is left empty.
+    With more `jobs`, the dump and the restore are run in parallel through a temporary directory,
+    each one opening up to `jobs` connections.
+    The dump is not compressed by default, set `compression` (1-9) when the dump
+    is not local and the bandwidth matters more than the CPU.
     """
     pg_from_infos, pg_target_infos = parse_pg_uri(from_pg_uri), parse_pg_uri(to_pg_uri)
-    for cmd in ["pg_dump", "createdb", "dropdb", "pg_restore", "psql"]:
+    for cmd in _COPY_DATABASE_CMDS:
         check_cmd(cmd)
-
-    with tempfile.NamedTemporaryFile(suffix=".dump") as tmp_file:
-        # tmp_file = '/tmp/schema.dump'
-        with temp_env({"PG_PASSWORD": pg_from_infos["password"]}):
-            pg_dump(
-                schemas=schemas,
-                dump_path=tmp_file.name,
-                options=[
-                    "-Fc",
-                    "--schema-only",
-                    "--no-owner",
-                    "--no-privileges",
-                    "--extension=*",
-                ],
-                user=pg_from_infos["user"],
-                host=pg_from_infos["host"],
-                port=pg_from_infos["port"],
-                database=from_db,
-            )
-
-        _partial_target_infos: dict = dict(pg_target_infos)
-        _partial_target_infos.pop("database")
-        with temp_env({"PG_PASSWORD": _partial_target_infos.pop("password")}):
+    _dump_options = [f"-Z{compression}", "--schema-only", "--no-owner", "--no-privileges", "--extension=*"]
+    _restore_options = ["--no-owner", "--no-privileges"]
+    _dump_infos = {"user": pg_from_infos["user"], "host": pg_from_infos["host"], "port": pg_from_infos["port"]}
+    _partial_target_infos: dict = dict(pg_target_infos)
+    _partial_target_infos.pop("database")
+    _target_password = _partial_target_infos.pop("password")
+
+    def _create_target_db():
+        with temp_env({"PG_PASSWORD": _target_password}):
             drop_db(
                 to_db,
                 **_partial_target_infos,
@@ -71,41 +82,80 @@ def copy_database(
 
             if "public" in schemas or drop_public:
                 exec_psql(to_db, "DROP SCHEMA public;", **_partial_target_infos)
+
+    if jobs == 1:
+        with temp_env({"PG_PASSWORD": pg_from_infos["password"]}):
+            # Any output on stderr means the source cannot be dumped, do not drop the target
+            exec_psql(from_db, "SELECT 1", **_dump_infos, on_stderr=_raise_pg_error)
+            dump_cmd = get_pg_dump_cmd(from_db, schemas, ["-Fc"] + _dump_options, **_dump_infos)
+            dump_env = get_pg_envs()
+        _create_target_db()
+        with temp_env({"PG_PASSWORD": _target_password}):
+            restore_cmd = get_pg_restore_cmd(to_db, options=_restore_options, **_partial_target_infos)
+            restore_env = get_pg_envs()
+        pg_dump_restore(dump_cmd, restore_cmd, dump_env=dump_env, restore_env=restore_env)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dump_dir = str(Path(tmp_dir) / "schema")
+        with temp_env({"PG_PASSWORD": pg_from_infos["password"]}):
+            pg_dump(
+                schemas=schemas,
+                dump_path=dump_dir,
+                options=_dump_options,
+                database=from_db,
+                jobs=jobs,
+                **_dump_infos,
+            )
+
+        _create_target_db()
+        with temp_env({"PG_PASSWORD": _target_password}):
             pg_restore(
-                dump_path=tmp_file.name,
+                dump_path=dump_dir,
                 database=to_db,
-                options=["--no-owner", "--no-privileges"],
+                options=_restore_options,
+                jobs=jobs,
                 **_partial_target_infos,
             )
 
 
+def _get_select_child_fk_data_queries(table: Table, child_table: Table) -> list[str]:
+    """
+    One query per foreign key of `child_table` referencing `table`, each matching on all
+    the columns of the key
+    """
+    queries = []
+    for _fk in child_table.foreign_keys:
+        if _fk.foreign_full_name != table.full_name:
+            continue
+        _on = " and ".join(
+            f"_s.{column_name} = t.{foreign_column_name}"
+            for column_name, foreign_column_name in zip(_fk.column_names, _fk.foreign_column_names)
+        )
+        # Semi join, a row referenced by multiple child rows is only selected once
+        queries.append(
+            f"SELECT {table.get_values('t')} from {table.full_name} t\n"
+            f"where exists(select from {child_table.tmp_name} _s where {_on})"
+        )
+    return queries
+
+
 def get_insert_child_fk_data_query(table: Table, child_table: Table) -> str:
     """
     Gets the query to insert data from a table to the temporary table.
     """
-    joins = []
-
-    def _fk_join(tmp_name: str, fk: FKConstraint, fk_index: int) -> str:
-        return f"inner join {tmp_name} _s{fk_index} on " + " and ".join(
-            f"_s{fk_index}.{column_name} = t.{foreign_column_name}"
-            for column_name, foreign_column_name in zip(fk.column_names, fk.foreign_column_names)
-        )
+    return get_insert_children_fk_data_query(table, [child_table])
 
-    for i, _fk in enumerate(child_table.foreign_keys):
-        if _fk.foreign_full_name != table.full_name:
-            continue
-        joins.append(_fk_join(child_table.tmp_name, _fk, i))
 
-    query = (
-        f"""
-    INSERT INTO {table.tmp_name} ({table.values})
-    SELECT {table.get_values('t')} from {table.full_name} t
+def get_insert_children_fk_data_query(table: Table, child_tables: list[Table]) -> str:
+    """
+    Gets the query to insert data from multiple child tables to the temporary table
+    in a single statement.
     """
-        + "\n".join(joins)
-        + "\n ON CONFLICT DO NOTHING"
+    selects = "\nUNION ALL\n".join(
+        _query for _child_table in child_tables for _query in _get_select_child_fk_data_queries(table, _child_table)
     )
-
-    return query
+    return f"INSERT INTO {table.tmp_name} ({table.values})\n{selects}\nON CONFLICT DO NOTHING"
 
 
 def get_insert_data_query(table: Table):
@@ -116,35 +166,78 @@ def get_insert_data_query(table: Table):
     """
     if where_str:
         query = f"{query}\nwhere not exists(select null from {table.tmp_name} t2 where {where_str})"
-    query = f"{query}\nLIMIT $1"
+    # Rows already pulled through a unique key referenced by a child table are skipped
+    query = f"{query}\nLIMIT $1\nON CONFLICT DO NOTHING"
     return query
 
 
-async def _insert_leaf_table(conn: asyncpg.Connection, table: Table, table_size: int):
+def _get_row_count(status: str) -> int:
+    """Returns the number of rows from a command status (ex: 'INSERT 0 10')"""
+    return int(status.rsplit(" ", 1)[-1])
+
+
+# - system_rows: exact number of rows, needs the `tsm_system_rows` extension
+# - bernoulli: built-in percentage of rows, can use parallel workers
+SampleMethod = Literal["system_rows", "bernoulli"]
+
+# Seed used by the bernoulli method, so the samples are reproducible
+_BERNOULLI_SEED = 42
+
+
+async def _insert_leaf_table(
+    conn: asyncpg.Connection,
+    table: Table,
+    table_size: int,
+    *,
+    method: SampleMethod = "system_rows",
+):
     query = f"CREATE TEMP TABLE {table.tmp_name} ON COMMIT DROP AS SELECT * from {table.full_name}"
-    args = []
+    args: list = []
     # if table_size > 0:
-    query = f"{query} TABLESAMPLE SYSTEM_ROWS($1)"
-    args.append(table_size)
+    if method == "bernoulli":
+        query = f"{query} TABLESAMPLE BERNOULLI($1) REPEATABLE({_BERNOULLI_SEED})"
+        args.append(table.sample_size)
+    else:
+        query = f"{query} TABLESAMPLE SYSTEM_ROWS($1)"
+        args.append(table_size)
     logs.debug(f"{query} {args}")
     await conn.execute(query, *args)
 
 
+def _quote_columns(columns: tuple[str, ...]) -> str:
+    return ", ".join(f'"{_col}"' for _col in columns)
+
+
 async def _insert_node_table(conn: asyncpg.Connection, table: Table, table_size: int):
-    # Creating the table
-    query = f"CREATE TEMP TABLE {table.tmp_name} (LIKE {table.full_name} INCLUDING ALL) ON COMMIT DROP"
+    # Creating the table, only the primary key and the keys referenced by the child tables are needed
+    # (to deduplicate the rows with ON CONFLICT and for `get_insert_data_query`).
+    # The identity columns are not part of the inserted values and must still be generated
+    _definition = f"LIKE {table.full_name} INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING GENERATED"
+    _pk_columns = tuple(_pk.column_name for _pk in table.primary_keys)
+    if _pk_columns:
+        _definition = f"{_definition}, PRIMARY KEY ({_quote_columns(_pk_columns)})"
+    # The referenced columns are unique in the source table (or the foreign keys could not exist)
+    _unique_columns = {
+        tuple(_fk.foreign_column_names)
+        for _child_table in table.child_tables_safe
+        for _fk in _child_table.foreign_keys
+        if _fk.foreign_full_name == table.full_name
+    }
+    for _columns in sorted(_unique_columns):
+        if set(_columns) == set(_pk_columns):
+            continue
+        _definition = f"{_definition}, UNIQUE ({_quote_columns(_columns)})"
+    query = f"CREATE TEMP TABLE {table.tmp_name} ({_definition}) ON COMMIT DROP"
     logs.debug(f"Create node table query: {query}")
     await conn.execute(query)
 
-    # Inserting data from child table
-    for _child_table in table.child_tables_safe:
-        query = get_insert_child_fk_data_query(table, _child_table)
+    # Inserting data from all the child tables in one statement, the table being empty
+    # the inserted rows are its size
+    count = 0
+    if _child_tables := list(table.child_tables_safe):
+        query = get_insert_children_fk_data_query(table, _child_tables)
         logs.debug(f"Insert child data query: {query}")
-        await conn.execute(query)
-
-    count = cast(int | None, await conn.fetchval(f"SELECT count(*) from {table.tmp_name}"))
-    if count is None:
-        raise NotImplementedError("Got empty table")
+        count = _get_row_count(await conn.execute(query))
 
     logs.debug(f"Table {table.tmp_name!r} has {count} rows, expected {table_size}")
     match count:
@@ -153,7 +246,8 @@ async def _insert_node_table(conn: asyncpg.Connection, table: Table, table_size:
         case count if count < table_size:
             query = get_insert_data_query(table)
             _limit = table_size - count
-            logs.debug(f"Got {count} < {table_size}, inserting data: {query.replace('$1', str(_limit))}")
+            if logs.isEnabledFor(logging.DEBUG):
+                logs.debug(f"Got {count} < {table_size}, inserting data: {query.replace('$1', str(_limit))}")
             await conn.execute(query, _limit)
         case count if count > table_size:
             logs.warning(f"Sample size cannot be reached (got {count}, expected {table_size})")
@@ -161,7 +255,12 @@ async def _insert_node_table(conn: asyncpg.Connection, table: Table, table_size:
             raise NotImplementedError(f"Got invalid count: {count} (table_size: {table_size})")
 
 
-async def process_table(table: Table, conn: asyncpg.Connection) -> set[Table]:
+async def process_table(
+    table: Table,
+    conn: asyncpg.Connection,
+    *,
+    method: SampleMethod = "system_rows",
+) -> set[Table]:
     """ """
     if table.has_been_processed:
         raise ValueError(f"Table {table.full_name!r} has already been processed")
@@ -170,16 +269,17 @@ async def process_table(table: Table, conn: asyncpg.Connection) -> set[Table]:
         raise ValueError(f"Got empty sample_size for {table.full_name!r}")
 
     table_size = floor(table.count * table.sample_size / 100)
-    logs.debug(
-        f"Processing table: {table.full_name} (is_leaf: {table.is_leaf}, "
-        f"sample_size: {table.sample_size}, "
-        f"table.count: {table.count}, "
-        f"table_size: {table_size}"
-        ")"
-    )
+    if logs.isEnabledFor(logging.DEBUG):
+        logs.debug(
+            f"Processing table: {table.full_name} (is_leaf: {table.is_leaf}, "
+            f"sample_size: {table.sample_size}, "
+            f"table.count: {table.count}, "
+            f"table_size: {table_size}"
+            ")"
+        )
     if table.is_leaf:
         logs.debug(f"\tInserting leaf table {table.full_name}")
-        await _insert_leaf_table(conn, table, table_size)
+        await _insert_leaf_table(conn, table, table_size, method=method)
     else:
         if table.children_has_been_processed:
             logs.debug(f"\tInserting node table {table.full_name}")
@@ -193,6 +293,184 @@ async def process_table(table: Table, conn: asyncpg.Connection) -> set[Table]:
     return {_parent_table for _parent_table in table.parent_tables_safe if not _parent_table.has_been_processed}
 
 
+# Number of COPY buffers that can be waiting to be sent to the target
+_COPY_PIPE_SIZE = 32
+
+
+async def _copy_table(
+    conn: asyncpg.Connection,
+    target_conn: asyncpg.Connection,
+    table: Table,
+    *,
+    conn_lock: asyncio.Lock,
+    on_copy: Callable[[int], None] | None = None,
+):
+    """
+    Copies the sampled rows of `table` to the target database.
+    Must be run in a transaction on `target_conn`.
+    The COPY output of the source is piped as is to a staging table on the target,
+    then inserted server side in one statement to keep the `ON CONFLICT DO NOTHING` semantic.
+    `conn` is shared between the concurrent copies, `conn_lock` serializes its usage.
+    """
+    query = f"SELECT {table.values} from {table.tmp_name}"
+    queue: asyncio.Queue[bytes | None] = asyncio.Queue(maxsize=_COPY_PIPE_SIZE)
+
+    async def _read():
+        try:
+            async with conn_lock:
+                # Text format: the binary one embeds the type OIDs of arrays and composites,
+                # which differ between the databases for user defined types
+                await conn.copy_from_query(query, output=queue.put, format="text")
+        except asyncio.CancelledError:
+            raise
+        except BaseException:
+            await queue.put(None)
+            raise
+        await queue.put(None)
+
+    async def _source():
+        while (data := await queue.get()) is not None:
+            yield data
+
+    # Only the copied columns, the identity and generated ones are left to the final insert
+    await target_conn.execute(
+        f"CREATE TEMP TABLE {table.tmp_name} ON COMMIT DROP AS "
+        f"SELECT {table.values} FROM {table.full_name} WITH NO DATA"
+    )
+    read_task = asyncio.create_task(_read())
+    try:
+        status = await target_conn.copy_to_table(
+            table.tmp_name, source=_source(), columns=table.column_names, format="text"
+        )
+    except BaseException:
+        read_task.cancel()
+        raise
+    await read_task
+    logs.debug(f"{table.full_name} ({status})")
+    if on_copy is not None:
+        on_copy(_get_row_count(status))
+    await target_conn.execute(
+        f"INSERT INTO {table.full_name} ({table.values}) "
+        f"SELECT {table.values} from {table.tmp_name} ON CONFLICT DO NOTHING"
+    )
+
+
+def get_insert_levels(tables: list[Table]) -> list[list[Table]]:
+    """
+    Groups the tables so that each table comes after the tables it references.
+    Tables of the same level do not depend on each other and can be inserted concurrently.
+    """
+    _tables = {table.full_name: table for table in tables}
+    indegree = {
+        name: sum(1 for _parent in table.parent_tables_safe if _parent.full_name in _tables)
+        for name, table in _tables.items()
+    }
+    children: dict[str, list[str]] = {name: [] for name in _tables}
+    for name, table in _tables.items():
+        for _parent in table.parent_tables_safe:
+            if _parent.full_name in _tables:
+                children[_parent.full_name].append(name)
+
+    levels = []
+    level = [name for name, degree in indegree.items() if degree == 0]
+    while level:
+        levels.append([_tables[name] for name in level])
+        _next_level = []
+        for name in level:
+            for _child in children[name]:
+                indegree[_child] -= 1
+                if indegree[_child] == 0:
+                    _next_level.append(_child)
+        level = _next_level
+
+    # Cyclic references, inserted last one after the other
+    _remaining = [_tables[name] for name, degree in indegree.items() if degree > 0]
+    levels.extend([table] for table in _remaining)
+    return levels
+
+
+async def _run_after_parents(tables: list[Table], fn: Callable[[Table], Awaitable[None]]):
+    """
+    Runs `fn` concurrently on `tables` (sorted with `get_insert_levels`), each table
+    starting as soon as the tables it references are done.
+    """
+    tasks: dict[str, asyncio.Task] = {}
+
+    async def _run(table: Table, parents: list[asyncio.Task]):
+        await asyncio.gather(*parents)
+        await fn(table)
+
+    for table in tables:
+        # Parents not yet scheduled are part of a cycle, they are not waited for
+        _parents = [tasks[x.full_name] for x in table.parent_tables_safe if x.full_name in tasks]
+        tasks[table.full_name] = asyncio.create_task(_run(table, _parents))
+
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        raise
+
+
+@contextlib.asynccontextmanager
+async def _acquire(target: asyncpg.Connection | asyncpg.Pool) -> AsyncIterator[asyncpg.Connection]:
+    if isinstance(target, asyncpg.Pool):
+        async with target.acquire() as conn:
+            # The pool proxy forwards everything to the underlying connection
+            yield cast(asyncpg.Connection, conn)
+    else:
+        yield target
+
+
+_INDEXES_QUERY = """
+SELECT i.indexrelid::regclass::text AS name, pg_get_indexdef(i.indexrelid) AS definition
+FROM pg_index i
+WHERE i.indrelid = ANY($1::regclass[])
+  -- Unique indexes are needed by ON CONFLICT
+  AND NOT i.indisunique
+  AND NOT EXISTS(SELECT FROM pg_constraint c WHERE c.conindid = i.indexrelid)
+"""
+
+
+# Memory of each index build, they can run concurrently (one per pooled connection)
+_INDEX_MAINTENANCE_WORK_MEM = "256MB"
+
+
+@contextlib.asynccontextmanager
+async def drop_indexes(target: asyncpg.Connection | asyncpg.Pool, tables: list[Table], *, active: bool = True):
+    """
+    Drops the indexes of `tables` that are not backing a constraint and recreates them on exit,
+    so they are built once instead of being updated on every insert.
+    If `target` is a pool, the indexes are recreated concurrently.
+    """
+    if not active:
+        yield
+        return
+
+    async with _acquire(target) as conn:
+        indexes = await conn.fetch(_INDEXES_QUERY, [table.full_name for table in tables])
+        if indexes:
+            logs.debug(f"Dropping {len(indexes)} indexes")
+            await conn.execute(f"DROP INDEX {', '.join(x['name'] for x in indexes)}")
+    try:
+        yield
+    finally:
+
+        async def _create_index(definition: str):
+            async with _acquire(target) as _conn, _conn.transaction():
+                await _conn.execute(f"SET LOCAL maintenance_work_mem = '{_INDEX_MAINTENANCE_WORK_MEM}'")
+                await _conn.execute(definition)
+
+        if indexes:
+            logs.debug(f"Recreating {len(indexes)} indexes")
+        if isinstance(target, asyncpg.Pool):
+            await asyncio.gather(*(_create_index(x["definition"]) for x in indexes))
+        else:
+            for x in indexes:
+                await _create_index(x["definition"])
+
+
 @contextlib.asynccontextmanager
 async def disable_trigger(conn: asyncpg.Connection, *, active: bool = True):
     if not active:
@@ -211,6 +489,7 @@ async def create_temp_tables(
     tables: list[Table],
     *,
     start_from: Literal["node", "leaf"] = "node",
+    method: SampleMethod = "system_rows",
 ):
     """
     Creates temporary tables with a sample of the original table.
@@ -219,61 +498,83 @@ async def create_temp_tables(
     """
 
     # We start from the nodes
-    _tables = set(
+    _start_tables = [
         table for table in tables if (table.is_root if start_from == "node" else table.is_leaf) and not table.ignore
-    )
+    ]
 
-    if not _tables:
+    if not _start_tables:
         raise NotImplementedError("No node table found")
 
-    while len(_tables) > 0:
-        _parent_tables = set()
-
-        for table in _tables:
-            if table.has_been_processed:
-                continue
-
-            _parent_tables = _parent_tables | await process_table(table, conn)
-
-        # To avoid infinite loop
-        if _tables == _parent_tables:
-            _not_processed = [_table for _table in tables if not _table.children_has_been_processed]
-
-            for _table in _not_processed:
-                logs.error(_table.full_name)
-                for c in _table.child_tables:
-                    logs.error(f"\t {c.full_name} ({c.has_been_processed})")
-            raise ValueError(
-                "Cyclic foreign keys detected. "
-                f'Possible tables are: {", ".join(x.full_name for x in _not_processed)}. '
-                "Run `analyze` with `--show-graphs` to debug."
-            )
-
-        _tables = _parent_tables
+    # Tables reachable from the starting ones
+    _tables: dict[str, Table] = {}
+    _to_visit = list(_start_tables)
+    while _to_visit:
+        table = _to_visit.pop()
+        if table.full_name in _tables:
+            continue
+        _tables[table.full_name] = table
+        _to_visit.extend(table.child_tables_safe)
+        _to_visit.extend(table.parent_tables_safe)
+
+    # A table is sampled from its children, so it is processed once all of them have been (Kahn's algorithm)
+    indegree: dict[str, int] = {}
+    dependents: dict[str, list[str]] = {name: [] for name in _tables}
+    for name, table in _tables.items():
+        _children = {_child.full_name for _child in table.child_tables_safe}
+        indegree[name] = len(_children)
+        for _child in _children:
+            dependents[_child].append(name)
+
+    ready = collections.deque(name for name, degree in indegree.items() if degree == 0)
+    while ready:
+        name = ready.popleft()
+        table = _tables[name]
+        if not table.has_been_processed:
+            await process_table(table, conn, method=method)
+        for _dependent in dependents[name]:
+            indegree[_dependent] -= 1
+            if indegree[_dependent] == 0:
+                ready.append(_dependent)
+
+    _not_processed = [_tables[name] for name, degree in indegree.items() if degree > 0]
+    if _not_processed:
+        for _table in _not_processed:
+            logs.error(_table.full_name)
+            for c in _table.child_tables:
+                logs.error(f"\t {c.full_name} ({c.has_been_processed})")
+        raise ValueError(
+            "Cyclic foreign keys detected. "
+            f'Possible tables are: {", ".join(x.full_name for x in _not_processed)}. '
+            "Run `analyze` with `--show-graphs` to debug."
+        )
 
 
 async def sample_database(
     conn: asyncpg.Connection,
-    target_conn: asyncpg.Connection,
+    target_conn: asyncpg.Connection | asyncpg.Pool,
     db: Database,
     *,
     show_progress: bool = False,
-    chunk_size: int = 5_000,
     # Deactivate triggers on reinserting to new database
     no_trigger: bool = True,
+    # Drop the (non unique) indexes of the new database and rebuild them once the data is inserted
+    no_index: bool = False,
+    # How to sample the leaf tables
+    method: SampleMethod = "system_rows",
 ):
     """
-    From top table to bottom
+    From top table to bottom.
+    If `target_conn` is a pool, the tables are inserted concurrently (up to the size of the pool),
+    each one as soon as the tables it references have been inserted.
     """
 
     # getting the leaves
-    has_ext = await check_extension_exists(conn, "tsm_system_rows")
-    if not has_ext:
+    if method == "system_rows" and not await check_extension_exists(conn, "tsm_system_rows"):
         await conn.execute("CREATE EXTENSION tsm_system_rows")
 
     async with conn.transaction():
         logs.info("Creating temporary tables")
-        await create_temp_tables(conn, db.tables)
+        await create_temp_tables(conn, db.tables, method=method)
 
         # Safety check
         _not_processed_tables = [x.full_name for x in db.tables if not x.has_been_processed]
@@ -286,32 +587,49 @@ async def sample_database(
         _table_count: dict[str, int] = {}
         if show_progress:
             logs.info("Loading tables count")
-            for table in db.tables:
-                _count = await conn.fetchval(f"SELECT count(*) from {table.tmp_name}")
-                if _count is None:
-                    raise ValueError("Got empty count")
-                _table_count[table.tmp_name] = _count
+            # Estimated counts, to avoid scanning every table
+            await conn.execute(f"ANALYZE {', '.join(table.tmp_name for table in db.tables)}")
+            _counts = await conn.fetch(
+                "SELECT relname, greatest(reltuples, 0)::bigint AS count FROM pg_class WHERE oid = ANY($1::regclass[])",
+                [table.tmp_name for table in db.tables],
+            )
+            _table_count = {x["relname"]: x["count"] for x in _counts}
 
         logs.info("Done creating temporary tables, inserting to new database.")
-        async with disable_trigger(target_conn, active=no_trigger):
+        conn_lock = asyncio.Lock()
+        async with drop_indexes(target_conn, db.tables, active=no_index):
             with Progress(disable=not show_progress) as progress:
                 task1 = progress.add_task("[green]Inserting tables....", total=len(db.tables))
-                task2 = progress.add_task("[purple]Inserting chunks....") if show_progress else None
-                for table in db.tables:
+                _on_copy: Callable[[int], None] | None = None
+                if show_progress:
+                    task2 = progress.add_task("[purple]Inserting rows....", total=sum(_table_count.values()))
+
+                    def _advance_rows(nb_rows: int):
+                        progress.update(task2, advance=nb_rows)
+
+                    _on_copy = _advance_rows
+
+                async def _insert_table(table: Table):
                     logs.debug(f"Inserting to {table.full_name}")
-                    if task2 is not None:
-                        progress.reset(task2, total=_table_count[table.tmp_name])
-                    query = f"SELECT {table.values} from {table.tmp_name}"
-
-                    async for chunk in iterate_pg(conn, query, chunk_size=chunk_size):
-                        logs.debug(f"{table.full_name} ({len(chunk)})")
-                        await insert_many(
-                            target_conn,
-                            table.full_name,
-                            [dict(x) for x in chunk],
-                            on_conflict="ON CONFLICT DO NOTHING",
-                            quote_columns=True,
+                    async with (
+                        _acquire(target_conn) as _target_conn,
+                        disable_trigger(_target_conn, active=no_trigger),
+                        _target_conn.transaction(),
+                    ):
+                        # The sampling can be run again if the target crashes, no need to wait for the WAL flush
+                        await _target_conn.execute("SET LOCAL synchronous_commit = off")
+                        await _copy_table(
+                            conn,
+                            _target_conn,
+                            table,
+                            conn_lock=conn_lock,
+                            on_copy=_on_copy,
                         )
-                        if task2 is not None:
-                            progress.update(task2, advance=chunk_size)
                     progress.update(task1, advance=1)
+
+                _tables = [table for level in get_insert_levels(db.tables) for table in level]
+                if isinstance(target_conn, asyncpg.Pool):
+                    await _run_after_parents(_tables, _insert_table)
+                else:
+                    for table in _tables:
+                        await _insert_table(table)
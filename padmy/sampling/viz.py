@@ -15,6 +15,11 @@ from dash import Dash, Output, Input, html
 import json
 import networkx as nx
 
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore
+
 cyto.load_extra_layouts()
 
 
@@ -35,11 +40,10 @@ class DirectedElement(typing.TypedDict):
 
 
 def get_directed_edges(g: nx.DiGraph) -> list[DirectedElement]:
-    directed_edges: list[DirectedElement] = [
-        {"data": {"id": f"{src}{tgt}", "source": src, "target": tgt}} for src, tgt in g.edges
-    ]
-    node_elems: list[DirectedElement] = [{"data": {"id": k, **v}} for k, v in g.nodes.data()]  # type: ignore
-    return node_elems + directed_edges
+    # Built in a single list, Cytoscape needs a JSON serializable list of elements
+    elements: list[DirectedElement] = [{"data": {"id": k, **v}} for k, v in g.nodes(data=True)]  # type: ignore
+    elements.extend({"data": {"id": src + tgt, "source": src, "target": tgt}} for src, tgt in g.edges)
+    return elements
 
 
 _CIRCULAR_NODE_STYLE = {
@@ -56,35 +60,26 @@ _CIRCULAR_EDGE_STYLE = {
 
 
 def get_cycles_styles(g: nx.DiGraph):
+    """
+    Highlights the tables and foreign keys that are part of a cycle.
+    Every strongly connected component with more than one node (or a self referencing node)
+    contains cycles, which avoids enumerating all the cycles of the graph.
+    """
     styles = []
-    for cycles in nx.simple_cycles(g):
-        # Self referencing
-        if len(cycles) == 1:
-            cycle = cycles[0]
-            styles += [
-                {
-                    "selector": f"#{cycle}",
-                    "style": {**_CIRCULAR_NODE_STYLE, "background-color": "red"},
-                },
-                {
-                    "selector": f"#{cycle}{cycle}",
-                    "style": {**_CIRCULAR_EDGE_STYLE, "background-color": "red"},
-                },
-            ]
-        else:
-            _src, _tgt = cycles
-            styles += [
-                {
-                    "selector": f"#{_src}",
-                    "style": {**_CIRCULAR_NODE_STYLE, "background-color": "red"},
-                },
-                {
-                    "selector": f"#{_tgt}",
-                    "style": {**_CIRCULAR_NODE_STYLE, "background-color": "red"},
-                },
-                {"selector": f"#{_src}{_tgt}", "style": _CIRCULAR_EDGE_STYLE},
-                {"selector": f"#{_tgt}{_src}", "style": _CIRCULAR_EDGE_STYLE},
-            ]
+    for component in nx.strongly_connected_components(g):
+        _subgraph = g.subgraph(component)
+        if len(component) == 1 and _subgraph.number_of_edges() == 0:
+            continue
+        styles += [
+            {"selector": f"#{node}", "style": {**_CIRCULAR_NODE_STYLE, "background-color": "red"}} for node in component
+        ]
+        styles += [
+            # Self referencing
+            {"selector": f"#{src}{tgt}", "style": {**_CIRCULAR_EDGE_STYLE, "background-color": "red"}}
+            if src == tgt
+            else {"selector": f"#{src}{tgt}", "style": _CIRCULAR_EDGE_STYLE}
+            for src, tgt in _subgraph.edges
+        ]
     return styles
 
 
@@ -117,6 +112,12 @@ def get_layout(
     return cyto.Cytoscape(layout={"name": layout}, style=_style, elements=elements, stylesheet=stylesheet)
 
 
+def _dumps(data) -> str:
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2).decode()
+    return json.dumps(data, indent=2)
+
+
 def run_simple_app(db: Database, port: int = 5555):
     g = convert_db(db)
     cyto_layout = get_layout(g)
@@ -138,13 +139,13 @@ def run_simple_app(db: Database, port: int = 5555):
         Input(layout_id, "tapNodeData"),
     )
     def _on_press_node(data):
-        return json.dumps(data, indent=2)
+        return _dumps(data)
 
     @app.callback(
         Output("cytoscape-tapEdgeData-output", "children"),
         Input(layout_id, "tapEdgeData"),
     )
     def _on_press_edge(data):
-        return json.dumps(data, indent=2)
+        return _dumps(data)
 
     app.run(port=port)  # type: ignore
@@ -4,13 +4,17 @@ import asyncpg
 import json
 import os
 import re
+import shlex
+import shutil
 import subprocess
+import tempfile
 import typing
 from contextlib import contextmanager
 from pathlib import Path
+from urllib.parse import urlsplit, quote, unquote
 from piou import Option, Derived, Password
 from typing import Sequence, AsyncIterator, Callable, TypeVar, cast, Literal
-from functools import partial
+from functools import partial, lru_cache
 
 from padmy import env
 from .env import PG_HOST, PG_PORT, PG_USER, PG_DATABASE, PG_PASSWORD
@@ -23,13 +27,18 @@ PgPassword = Option(PG_PASSWORD, "-p", help="PG Password")
 PgDatabase = Option(PG_DATABASE, "--db", help="PG Database")
 
 
+def _build_pg_root(user: str, password: str, host: str, port: int) -> str:
+    # The credentials are quoted, so that any character can be used in them
+    return f"postgresql://{quote(str(user), safe='')}:{quote(str(password), safe='')}@{host}:{port}"
+
+
 def get_pg_root(
     pg_host: str = Option(PG_HOST, "--host", help="PG Host"),
     pg_port: int = Option(PG_PORT, "--port", help="PG Port"),
     pg_user: str = Option(PG_USER, "--user", help="PG User"),
     pg_password: Password = Option(PG_PASSWORD, "-p", help="PG Password"),
 ):
-    return f"postgresql://{pg_user}:{pg_password}@{pg_host}:{pg_port}"
+    return _build_pg_root(pg_user, pg_password, pg_host, pg_port)
 
 
 def get_pg_url(pg_url: str = Derived(get_pg_root), pg_database: str = PgDatabase):
@@ -45,17 +54,84 @@ async def get_pg(pg_url: str = Derived(get_pg_url)):
 OnStdErrorFn = Callable[[str], None]
 
 
+def _join_cmd(cmd: Sequence[str | Path]) -> str:
+    """Shell escaped representation of `cmd`, for the logs and the errors"""
+    return shlex.join(str(x) for x in cmd)
+
+
+def _get_argv(cmd: Sequence[str | Path]) -> list[str]:
+    # A string would be split into characters, the commands are not run through a shell anymore
+    if isinstance(cmd, str):
+        raise TypeError(f"Expected a list of arguments, got a string: {cmd!r}")
+    return [str(x) for x in cmd]
+
+
 def exec_cmd(
-    cmd: Sequence[str | int],
+    cmd: Sequence[str | Path],
     env: dict | None = None,
     *,
     on_stderr: OnStdErrorFn | None = None,
+    stdout: typing.IO[bytes] | None = None,
 ) -> str:
-    _cmd = cmd if isinstance(cmd, str) else " ".join(str(x) for x in cmd)
-    logs.debug(f"Executing cmd: {_cmd}")
-    stdout, stderr = subprocess.Popen(
-        _cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env
+    """
+    Executes `cmd` without going through a shell, the arguments are passed as is.
+    If `stdout` is set, the output of the command is written to it and an empty string is returned.
+    """
+    _cmd = _get_argv(cmd)
+    logs.debug(f"Executing cmd: {_join_cmd(_cmd)}")
+    _stdout, stderr = subprocess.Popen(
+        _cmd, stdout=subprocess.PIPE if stdout is None else stdout, stderr=subprocess.PIPE, env=env
     ).communicate()
+    if stderr:
+        _msg = stderr.decode("utf-8")
+        if on_stderr is not None:
+            on_stderr(_msg)
+        else:
+            logs.warning(_msg)
+    return _stdout.decode("utf-8") if _stdout is not None else ""
+
+
+def exec_cmd_to_file(
+    cmd: Sequence[str | Path],
+    path: str | Path,
+    env: dict | None = None,
+    *,
+    on_stderr: OnStdErrorFn | None = None,
+):
+    """
+    Executes `cmd` and writes its stdout directly to `path`,
+    the output never goes through Python (only stderr is captured).
+    """
+    with open(path, "wb") as f:
+        exec_cmd(cmd, env=env, on_stderr=on_stderr, stdout=f)
+
+
+def exec_pipe(
+    cmd: Sequence[str | Path],
+    to_cmd: Sequence[str | Path],
+    env: dict | None = None,
+    to_env: dict | None = None,
+    *,
+    on_stderr: OnStdErrorFn | None = None,
+) -> str:
+    """
+    Executes `cmd` and pipes its stdout to `to_cmd`, each one with its own environment.
+    Returns the stdout of `to_cmd`, the stderr of both commands is passed to `on_stderr`.
+    """
+    _cmd, _to_cmd = _get_argv(cmd), _get_argv(to_cmd)
+    logs.debug(f"Executing cmd: {_join_cmd(_cmd)} | {_join_cmd(_to_cmd)}")
+    # Spooled to a file so that a verbose `cmd` never blocks on a full stderr pipe
+    with tempfile.TemporaryFile() as cmd_stderr:
+        process = subprocess.Popen(_cmd, stdout=subprocess.PIPE, stderr=cmd_stderr, env=env)
+        to_process = subprocess.Popen(
+            _to_cmd, stdin=process.stdout, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=to_env
+        )
+        # So that `cmd` gets a SIGPIPE if `to_cmd` exits early
+        cast(typing.IO[bytes], process.stdout).close()
+        stdout, to_stderr = to_process.communicate()
+        process.wait()
+        cmd_stderr.seek(0)
+        stderr = cmd_stderr.read() + to_stderr
     if stderr:
         _msg = stderr.decode("utf-8")
         if on_stderr is not None:
@@ -66,7 +142,7 @@ def exec_cmd(
 
 
 def has_cmd(cmd: str) -> bool:
-    return exec_cmd(f'command -v "{cmd}"') != ""
+    return shutil.which(cmd) is not None
 
 
 class CommandNotFound(Exception):
@@ -79,11 +155,17 @@ _COMMANDS = {}
 
 
 def check_cmd(cmd: str):
+    """
+    Checks that `cmd` is available and stores its path.
+    Commands already found are not checked again.
+    """
     global _COMMANDS
-    path = exec_cmd(f'command -v "{cmd}"')
-    if path == "":
+    if cmd in _COMMANDS:
+        return
+    path = shutil.which(cmd)
+    if path is None:
         raise CommandNotFound(cmd=cmd)
-    _COMMANDS[cmd] = path.strip()
+    _COMMANDS[cmd] = path
 
 
 def _get_check_cmd(cmd: str):
@@ -92,7 +174,13 @@ def _get_check_cmd(cmd: str):
     return _COMMANDS[cmd]
 
 
-def get_pg_envs():
+_PG_ENV_VARS = ("PG_PASSWORD", "PG_USER", "PG_HOST", "PG_PORT")
+
+
+@lru_cache(maxsize=1)
+def _get_pg_envs(_snapshot: tuple[str | None, ...]) -> dict[str, str]:
+    # `_snapshot` is only used as the cache key, the env module is reloaded
+    # to get the defaults when one of the variables has changed
     reload(env)
     return {
         "PGPASSWORD": env.PG_PASSWORD,
@@ -102,6 +190,10 @@ def get_pg_envs():
     }
 
 
+def get_pg_envs():
+    return dict(_get_pg_envs(tuple(os.environ.get(x) for x in _PG_ENV_VARS)))
+
+
 class PGError(Exception):
     def __init__(self, msg: str, cmd: str | None = None):
         super().__init__(msg)
@@ -116,7 +208,7 @@ class PGError(Exception):
 
 def _on_pg_error(msg: str, cmd: list[str] | str):
     if "ERROR" in msg or "FATAL" in msg:
-        _cmd = cmd if isinstance(cmd, str) else " ".join(str(x) for x in cmd)
+        _cmd = cmd if isinstance(cmd, str) else _join_cmd(cmd)
         raise PGError(msg, cmd=_cmd)
 
 
@@ -130,14 +222,13 @@ def _get_conn_infos(
     cmd = []
     for k, v in infos.items():
         if v is not None:
-            cmd += [k, v]
+            cmd += [k, str(v)]
     return cmd
 
 
-def pg_dump(
+def get_pg_dump_cmd(
     database: str,
     schemas: list[str],
-    dump_path: str | None = None,
     options: list[str] | None = None,
     with_grants: bool = True,
     with_comments: bool = True,
@@ -146,28 +237,84 @@ def pg_dump(
     password: str | None = None,
     host: str | None = None,
     port: int | None = None,
-    on_stderr: OnStdErrorFn | None = None,
-    get_env: bool = True,
-) -> str | None:
-    _schemas = "|".join(x for x in schemas)
-    cmd = [
-        _get_check_cmd("pg_dump"),
-        "-n",
-        f"'({_schemas})'",
-        "-d",
-        database,
-    ] + _get_conn_infos(user, password, host, port)
+) -> list[str]:
+    cmd = [_get_check_cmd("pg_dump")]
+    for schema in schemas:
+        cmd += ["-n", schema]
+    cmd += ["-d", database] + _get_conn_infos(user, password, host, port)
     if not with_grants:
         cmd += ["--no-owner", "--no-privileges"]
     if not with_comments:
         cmd += ["--no-comments"]
     if options:
         cmd += options
+    return cmd
 
-    if dump_path:
-        cmd += [">", dump_path]
+
+def pg_dump(
+    database: str,
+    schemas: list[str],
+    dump_path: str | None = None,
+    options: list[str] | None = None,
+    with_grants: bool = True,
+    with_comments: bool = True,
+    *,
+    user: str | None = None,
+    password: str | None = None,
+    host: str | None = None,
+    port: int | None = None,
+    on_stderr: OnStdErrorFn | None = None,
+    get_env: bool = True,
+    jobs: int | None = None,
+) -> str | None:
+    """
+    Dumps `schemas` to `dump_path`, or returns the dump if no path is given.
+    With `jobs`, the tables are dumped in parallel in the directory format,
+    `dump_path` is then the output directory.
+    """
+    if jobs is not None and not dump_path:
+        raise ValueError("A dump_path (directory) is required for a parallel dump")
+    cmd = get_pg_dump_cmd(
+        database,
+        schemas,
+        options,
+        with_grants,
+        with_comments,
+        user=user,
+        password=password,
+        host=host,
+        port=port,
+    )
     _on_stderr = on_stderr or partial(_on_pg_error, cmd=cmd)
-    return exec_cmd(cmd, env=get_pg_envs() if get_env else None, on_stderr=_on_stderr)
+    _env = get_pg_envs() if get_env else None
+    if jobs is not None:
+        cmd += ["-Fd", "-f", cast(str, dump_path), "--jobs", str(jobs)]
+        exec_cmd(cmd, env=_env, on_stderr=_on_stderr)
+        return None
+    if dump_path:
+        exec_cmd_to_file(cmd, dump_path, env=_env, on_stderr=_on_stderr)
+        return None
+    return exec_cmd(cmd, env=_env, on_stderr=_on_stderr)
+
+
+def get_pg_restore_cmd(
+    database: str,
+    dump_path: str | None = None,
+    options: list[str] | None = None,
+    *,
+    user: str | None = None,
+    password: str | None = None,
+    host: str | None = None,
+    port: int | None = None,
+) -> list[str]:
+    """Without `dump_path`, the dump is read from stdin"""
+    cmd = [_get_check_cmd("pg_restore"), "-d", database]
+    if dump_path is not None:
+        cmd.append(dump_path)
+    cmd += _get_conn_infos(user, password, host, port)
+    if options is not None:
+        cmd += options
+    return cmd
 
 
 def pg_restore(
@@ -180,14 +327,33 @@ def pg_restore(
     host: str | None = None,
     port: int | None = None,
     on_stderr: OnStdErrorFn | None = None,
+    jobs: int | None = None,
 ):
-    cmd = [_get_check_cmd("pg_restore"), "-d", database, dump_path] + _get_conn_infos(user, password, host, port)
-    if options is not None:
-        cmd += options
+    """`jobs` restores in parallel, the dump must be in the custom or the directory format"""
+    cmd = get_pg_restore_cmd(database, dump_path, options, user=user, password=password, host=host, port=port)
+    if jobs is not None:
+        cmd += ["--jobs", str(jobs)]
     _on_stderr = on_stderr or partial(_on_pg_error, cmd=cmd)
     exec_cmd(cmd, env=get_pg_envs(), on_stderr=_on_stderr)
 
 
+def pg_dump_restore(
+    dump_cmd: list[str],
+    restore_cmd: list[str],
+    *,
+    dump_env: dict | None = None,
+    restore_env: dict | None = None,
+    on_stderr: OnStdErrorFn | None = None,
+):
+    """
+    Pipes the output of pg_dump into pg_restore, the dump is never written to disk.
+    The commands are built with `get_pg_dump_cmd` (with a non plain format) and `get_pg_restore_cmd`
+    (without dump path).
+    """
+    _on_stderr = on_stderr or partial(_on_pg_error, cmd=f"{_join_cmd(dump_cmd)} | {_join_cmd(restore_cmd)}")
+    exec_pipe(dump_cmd, restore_cmd, env=dump_env, to_env=restore_env, on_stderr=_on_stderr)
+
+
 def create_db(
     database: str,
     *,
@@ -246,7 +412,7 @@ def exec_psql(
     port: int | None = None,
     on_stderr: OnStdErrorFn | None = None,
 ):
-    cmd = [_get_check_cmd("psql"), "-c", f"'{query}'", "-d", database] + _get_conn_infos(user, password, host, port)
+    cmd = [_get_check_cmd("psql"), "-c", query, "-d", database] + _get_conn_infos(user, password, host, port)
     _on_stderr = on_stderr or partial(_on_pg_error, cmd=cmd)
     exec_cmd(cmd, env=get_pg_envs(), on_stderr=_on_stderr)
 
@@ -260,7 +426,7 @@ async def iterate_pg(
     query: str,
     *args,
     from_offset: int = 0,
-    chunk_size: int = 500,
+    chunk_size: int = 1024,
     timeout: int | None = None,
 ) -> AsyncIterator[list[asyncpg.Record]]:
     async with conn.transaction():
@@ -306,10 +472,7 @@ X = TypeVar("X")
 
 
 def get_first(*it: X, fn: Callable) -> X | None:
-    for v in it:
-        if fn(v):
-            return v
-    return None
+    return next(filter(fn, it), None)
 
 
 async def get_conn(pool: asyncpg.Pool, fn: Callable):
@@ -346,8 +509,8 @@ def get_pg_root_from(source: Literal["from", "to"]):
             arg_name=f"pg_password_{_source}",
         ),
     ):
-        url = f"postgresql://{pg_user}:{pg_password}@{pg_host}:{pg_port}"
-        pg_clean = url.replace(f":{pg_password}", ":********")
+        url = _build_pg_root(pg_user, pg_password, pg_host, pg_port)
+        pg_clean = url.replace(f":{quote(str(pg_password), safe='')}@", ":********@")
         logs.debug(f"PG url {source}: {pg_clean}")
         return url
 
@@ -362,20 +525,27 @@ class PGUriInfos(typing.TypedDict):
     database: str | None
 
 
-_PG_URI_REG = re.compile(r"postgresql:\/\/(?P<user>.*):(?P<password>.*)@(?P<host>.*):(?P<port>\d+)(\/(?P<dbname>.*))?")
+@lru_cache(maxsize=32)
+def _parse_pg_uri(uri: str) -> PGUriInfos:
+    try:
+        _uri = urlsplit(uri)
+        _port = _uri.port
+    except ValueError as e:
+        raise ValueError(f"Invalid PG uri: {uri}") from e
+    if _uri.scheme != "postgresql" or None in (_uri.username, _uri.password, _uri.hostname, _port):
+        raise ValueError(f"Invalid PG uri: {uri}")
+    return {
+        "user": unquote(cast(str, _uri.username)),
+        "password": unquote(cast(str, _uri.password)),
+        "host": cast(str, _uri.hostname),
+        "port": cast(int, _port),
+        "database": _uri.path.removeprefix("/") if _uri.path else None,
+    }
 
 
 def parse_pg_uri(uri: str) -> PGUriInfos:
-    if match := _PG_URI_REG.match(uri):
-        group = match.groupdict()
-        return {
-            "user": group["user"],
-            "password": group["password"],
-            "host": group["host"],
-            "port": int(group["port"]),
-            "database": group["dbname"],
-        }
-    raise ValueError(f"Invalid PG uri: {uri}")
+    # Copied, the cached value must not be modified by the callers
+    return cast(PGUriInfos, dict(_parse_pg_uri(uri)))
 
 
 @contextmanager
@@ -383,12 +553,17 @@ def temp_env(new_env: dict):
     """
     Overrides the environment variables with the given ones
     """
-    _env = os.environ.copy()
+    # Only the overridden variables are saved, the ones that did not exist are removed on exit
+    _saved = {k: os.environ.get(k) for k in new_env}
     os.environ.update(new_env)
     try:
         yield
     finally:
-        os.environ.update(_env)
+        for k, v in _saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
 
 
 @contextmanager
@@ -415,8 +590,11 @@ async def init_connection(conn: asyncpg.Connection):
     await conn.set_type_codec("json", encoder=json.dumps, decoder=json.loads, schema="pg_catalog")
 
 
-_IS_ERROR_REG = re.compile(r".*(?P<error_type>ERROR|FATAL):(?P<msg>.*)")
-_IS_INFO_REG = re.compile(r".*NOTICE:(?P<msg>.*)")
+# An ERROR / FATAL (or NOTICE) line followed by its continuation lines (until the next such line)
+_PG_RECORD_REG = re.compile(
+    r"^(?:.*(?P<error_type>ERROR|FATAL):(?P<msg>.*)|.*NOTICE:.*)(?P<lines>(?:\n(?!.*(?:ERROR|FATAL|NOTICE):).*)*)",
+    flags=re.MULTILINE,
+)
 _CLEAN_STR_REG = re.compile(r"^E\s+|\s{2,}", flags=re.MULTILINE)
 
 
@@ -424,26 +602,16 @@ def _clean_str(msg: str) -> str:
     return _CLEAN_STR_REG.sub(" ", msg).strip()
 
 
+def _get_pg_error(match: re.Match) -> str:
+    # The continuation lines are cleaned one by one before the whole error
+    _lines = [_clean_str(line) for line in match["lines"].split("\n")[1:]]
+    return _clean_str("\n".join([f"{match['error_type']}: {match['msg']}", *_lines]))
+
+
 def extract_pg_error(msg: str) -> list[str]:
     """
     Extracts the errors from a pg error message
     """
-    errors = []
-    current_error = None
-    for line in msg.splitlines():
-        if _match_error := _IS_ERROR_REG.match(line):
-            if current_error is not None:
-                errors.append(_clean_str(current_error))
-            current_error = f"{_match_error.group('error_type')}: {_match_error.group('msg')}"
-        elif _match_info := _IS_INFO_REG.match(line):
-            if current_error is not None:
-                errors.append(_clean_str(current_error))
-            current_error = None
-        else:
-            if current_error is not None:
-                current_error += f"\n{_clean_str(line)}"
-
-    if current_error is not None:
-        errors.append(_clean_str(current_error))
-
-    return errors
+    # Same line breaks as `str.splitlines`
+    _msg = "\n".join(msg.splitlines())
+    return [_get_pg_error(_match) for _match in _PG_RECORD_REG.finditer(_msg) if _match["error_type"] is not None]
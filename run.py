@@ -15,7 +15,7 @@ from padmy.logs import setup_logging, logs
 from padmy.migration import migration
 from padmy.sampling import sample_database, copy_database
 from padmy.utils import get_pg_root, get_pg_root_from, init_connection
-from padmy.env import CONSOLE
+from padmy.env import CONSOLE, SAMPLE_POOL_SIZE
 
 cli = Cli("Padmy utility commands")
 
@@ -64,6 +64,12 @@ async def sample_main(
     pg_from: str = Derived(get_pg_root_from("from")),
     pg_to: str = Derived(get_pg_root_from("to")),
     progress: bool = Option(False, "--progress", help="Show sampling progress"),
+    bernoulli: bool = Option(
+        False, "--bernoulli", help="Sample leaf tables with TABLESAMPLE BERNOULLI (no tsm_system_rows extension)"
+    ),
+    drop_indexes: bool = Option(
+        False, "--drop-indexes", help="Drop the target indexes while inserting and rebuild them afterwards"
+    ),
 ):
     """
     Create a copy of a given database and inserts a sample to a new database
@@ -95,20 +101,30 @@ async def sample_main(
 
     # TODO clean if error
     conn = await asyncpg.connect(f"{pg_from}/{from_db}", statement_cache_size=0)
-    target_conn = await asyncpg.connect(f"{pg_to}/{to_db}")
 
     db = await get_explored_db(pg_from, from_db, _schemas)
     db.load_config(config)
 
+    # One connection per table inserted concurrently
+    _pool_size = max(1, min(len(db.tables), SAMPLE_POOL_SIZE))
+    target_pool = await asyncpg.create_pool(f"{pg_to}/{to_db}", min_size=_pool_size, max_size=_pool_size)
+
     pretty_print_stats(db)
 
     try:
-        await sample_database(conn, target_conn, db, show_progress=progress)
+        await sample_database(
+            conn,
+            target_pool,
+            db,
+            show_progress=progress,
+            no_index=drop_indexes,
+            method="bernoulli" if bernoulli else "system_rows",
+        )
     except Exception as e:
         raise e
     finally:
         await asyncio.wait_for(conn.close(), timeout=1)
-        await asyncio.wait_for(target_conn.close(), timeout=1)
+        await asyncio.wait_for(target_pool.close(), timeout=1)
 
     new_db = await get_explored_db(pg_to, to_db, _schemas)
 
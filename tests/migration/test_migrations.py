@@ -108,6 +108,7 @@ def test_migrate_verify_valid(monkeypatch, engine, tmp_path, only_last):
 
 
 @pytest.mark.usefixtures("setup_test_schema")
+@pytest.mark.parametrize("in_memory", [False, True])
 @pytest.mark.parametrize("only_last", [False, True])
 @pytest.mark.parametrize(
     "migration_dir, error_msg",
@@ -118,7 +119,7 @@ def test_migrate_verify_valid(monkeypatch, engine, tmp_path, only_last):
         ),
     ],
 )
-def test_migrate_verify(engine, tmp_path, only_last, migration_dir, error_msg):
+def test_migrate_verify(engine, tmp_path, only_last, migration_dir, error_msg, in_memory):
     from padmy.migration import migrate_verify
     from padmy.migration.migration import MigrationError
 
@@ -126,7 +127,7 @@ def test_migrate_verify(engine, tmp_path, only_last, migration_dir, error_msg):
         migrate_verify(
             database=PG_DATABASE,
             schemas=["general"],
-            dump_dir=tmp_path,
+            dump_dir=None if in_memory else tmp_path,
             migration_folder=migration_dir,
             only_last=only_last,
         )
@@ -535,3 +536,16 @@ class TestMigrationFiles:
             assert verify_migration_files(migration_dir, raise_error=True) == e
 
         assert capsys.readouterr().out.strip()
+
+    @pytest.mark.usefixtures("setup_invalid_up_migration_files")
+    def test_verify_migration_files_all_errors(self, migration_dir):
+        from padmy.migration.utils import verify_migration_files, MigrationFileError
+
+        with pytest.raises(MigrationFileError) as e:
+            verify_migration_files(migration_dir, raise_error=True)
+
+        assert e.value.errors == [
+            "Invalid header for up file 2-20000000-up.sql : (expected '1-10000000-up.sql' got '0-10000000')",
+            "Invalid header for down file 2-20000000-down.sql : (expected '1-10000000-down.sql' got '0-10000000')",
+        ]
+        assert verify_migration_files(migration_dir, raise_error=False)
@@ -1,4 +1,5 @@
 import datetime as dt
+from unittest.mock import Mock
 
 import pytest
 
@@ -61,3 +62,95 @@ def test_reorder(setup_fn, last_migration_ids, migration_folder, expected):
     new_order = list([x.file_id for x in get_files(migration_folder, up_only=True)])
     assert new_order == expected
     assert not verify_migration_files(migration_folder)
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        pytest.param("", Header(prev_file=None, author=None, version=None), id="empty"),
+        pytest.param(
+            "-- Prev-file: 1-00000000-up.sql\n-- Author: foo@baz.baz\n-- Version: 0.0.0\nSELECT 1;",
+            Header(prev_file="1-00000000-up.sql", author="foo@baz.baz", version="0.0.0"),
+            id="full header",
+        ),
+        pytest.param(
+            "-- Prev-file:\n-- Author: foo@baz.baz\nSELECT 1;",
+            Header(prev_file="", author="foo@baz.baz", version=None),
+            id="no prev file",
+        ),
+        pytest.param(
+            "-- Prev-file: 1-00000000-up.sql\n-- Author: foo <https://foo.baz>\n-- Version: 1:0",
+            Header(prev_file="1-00000000-up.sql", author="foo <https://foo.baz>", version="1:0"),
+            id="colons in values",
+        ),
+    ],
+)
+def test_header_from_text(text, expected):
+    assert Header.from_text(text) == expected
+    assert Header.from_text(text.encode()) == expected
+
+
+def test_get_files_header_changed(migration_folder):
+    _file = MigrationFile(
+        ts=DEFAULT_TIME,
+        file_id="0000000",
+        file_type="up",
+        path=migration_folder / f"{int(DEFAULT_TIME.timestamp())}-0000000-up.sql",
+        header=Header(prev_file=None, author="foo", version=None),
+    )
+    _file.write_header()
+    (_loaded,) = get_files(migration_folder)
+    assert _loaded.header == Header(prev_file="", author="foo", version=None)
+
+    # The header must be parsed again once the file has changed
+    _file.header = Header(prev_file=None, author="bar", version="0.0.1")
+    _file.write_header()
+    (_loaded,) = get_files(migration_folder)
+    assert _loaded.header == Header(prev_file="", author="bar", version="0.0.1")
+
+
+def test_write_header_keeps_body(migration_folder):
+    _path = migration_folder / "1-00000000-up.sql"
+    _path.write_text("-- Prev-file:\n-- Author: foo\nCREATE TABLE foo();\n-- Some comment\nSELECT 1;\n")
+
+    _file = MigrationFile.from_file(_path)
+    _file.header = Header(prev_file="0-00000000-up.sql", author="bar", version=None)
+    _file.write_header()
+
+    assert _path.read_text() == (
+        "-- Prev-file: 0-00000000-up.sql\n-- Author: bar\nCREATE TABLE foo();\n-- Some comment\nSELECT 1;\n"
+    )
+
+
+@pytest.mark.usefixtures("setup_migration_folder")
+def test_verify_migration_files_cache(migration_folder, tmp_path, monkeypatch):
+    from padmy.migration import verify_migration_files, MigrationFileError
+
+    monkeypatch.setenv("PADMY_FOLDER", str(tmp_path / ".padmy"))
+    assert not verify_migration_files(migration_folder, use_cache=True)
+    assert (tmp_path / ".padmy" / "verify-cache.json").exists()
+
+    # Files did not change, they are not read again
+    with monkeypatch.context() as m:
+        m.setattr("padmy.migration.utils.get_files", Mock(side_effect=NotImplementedError))
+        assert not verify_migration_files(migration_folder, use_cache=True)
+
+    # Changing a file invalidates the cache
+    last_up_file = get_files(migration_folder, reverse=True, up_only=True)[0]
+    assert last_up_file.header is not None
+    last_up_file.header.prev_file = "foo"
+    last_up_file.write_header()
+    with pytest.raises(MigrationFileError):
+        verify_migration_files(migration_folder, use_cache=True)
+
+
+@pytest.mark.usefixtures("setup_migration_folder")
+def test_verify_migration_files_duplicate_id(migration_folder):
+    from padmy.migration import verify_migration_files, MigrationFileError
+
+    _base_name = MigrationFile.generate_base_name(ts=int(DEFAULT_TIME.timestamp()) + 1, file_id="0000002")
+    (migration_folder / f"{_base_name}-up.sql").write_text("SELECT 1;")
+
+    with pytest.raises(MigrationFileError) as e:
+        verify_migration_files(migration_folder)
+    assert 'Found multiple "up" files (file_id: 0000002)' in e.value.errors
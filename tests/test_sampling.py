@@ -59,6 +59,62 @@ def get_table_multiple_constraints():
     return table
 
 
+def test_get_insert_levels():
+    from padmy.db import Table
+    from padmy.sampling.sampling import get_insert_levels
+
+    table_1, table_2, table_3, table_4 = (Table(schema="public", table=f"table_{i}") for i in range(1, 5))
+    # table_3 references table_1 and table_2, table_4 references table_3
+    table_3.parent_tables = {table_1, table_2}
+    table_4.parent_tables = {table_3}
+
+    levels = get_insert_levels([table_4, table_3, table_2, table_1])
+    assert [sorted(x.full_name for x in level) for level in levels] == [
+        ["public.table_1", "public.table_2"],
+        ["public.table_3"],
+        ["public.table_4"],
+    ]
+
+
+def test_get_insert_children_fk_data_query():
+    from padmy.db import Table, Column, FKConstraint
+    from padmy.sampling.sampling import get_insert_children_fk_data_query
+
+    table = Table(schema="public", table="table_1", columns=[Column(name="id", is_generated=False)])
+    # Both foreign keys reference table_1, each one gets its own select
+    child_table = Table(
+        schema="public",
+        table="table_2",
+        foreign_keys=[
+            FKConstraint(
+                column_names=["created_by"],
+                constraint_name="t2_created_by",
+                foreign_schema="public",
+                foreign_table="table_1",
+                foreign_column_names=["id"],
+            ),
+            FKConstraint(
+                column_names=["updated_by"],
+                constraint_name="t2_updated_by",
+                foreign_schema="public",
+                foreign_table="table_1",
+                foreign_column_names=["id"],
+            ),
+        ],
+    )
+
+    query = get_insert_children_fk_data_query(table, [child_table])
+    assert query == (
+        'INSERT INTO _public_table_1_tmp ("id")\n'
+        'SELECT t."id" from public.table_1 t\n'
+        "where exists(select from _public_table_2_tmp _s where _s.created_by = t.id)\n"
+        "UNION ALL\n"
+        'SELECT t."id" from public.table_1 t\n'
+        "where exists(select from _public_table_2_tmp _s where _s.updated_by = t.id)\n"
+        "ON CONFLICT DO NOTHING"
+    )
+
+
 def test_sample_db_circular_single(loop, aengine):
     from padmy.sampling.sampling import create_temp_tables
     from padmy.db import Table, FKConstraint
@@ -223,6 +279,90 @@ def setup_3_simple_tables(engine, sample_engine):
     sample_engine.commit()
 
 
+@pytest.fixture()
+def setup_identity_tables(engine, sample_engine):
+    query = """
+    DROP SCHEMA IF EXISTS tmptest CASCADE;
+    CREATE SCHEMA tmptest;
+    CREATE TABLE IF NOT EXISTS tmptest.table_1
+    (
+        id  INT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+        foo TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS tmptest.table_2
+    (
+        id         SERIAL PRIMARY KEY,
+        table_1_id INT REFERENCES tmptest.table_1 ON DELETE CASCADE
+    );
+    """
+    engine.execute(query)
+    engine.execute("INSERT INTO tmptest.table_1 (foo) SELECT 'foo-' || i FROM generate_series(1, 10) i")
+    engine.execute("INSERT INTO tmptest.table_2 (id, table_1_id) VALUES (0, 1)")
+    engine.commit()
+
+    sample_engine.execute(query)
+    sample_engine.commit()
+
+
+@pytest.fixture()
+def setup_enum_array_tables(engine, sample_engine):
+    schema_query = "DROP SCHEMA IF EXISTS tmptest CASCADE; CREATE SCHEMA tmptest;"
+    query = """
+    CREATE TYPE tmptest.mood AS ENUM ('happy', 'sad');
+    CREATE TABLE IF NOT EXISTS tmptest.table_1
+    (
+        id    SERIAL PRIMARY KEY,
+        moods tmptest.mood[] NOT NULL
+    );
+    """
+    engine.execute(schema_query)
+    engine.execute(query)
+    engine.execute("INSERT INTO tmptest.table_1 (id, moods) VALUES (0, '{happy,sad}'), (1, '{sad}')")
+    engine.commit()
+
+    sample_engine.execute(schema_query)
+    # Another type first, so that the enum gets a different OID in the sample database
+    sample_engine.execute("CREATE TYPE tmptest.other AS ENUM ('foo')")
+    sample_engine.execute(query)
+    sample_engine.commit()
+
+
+@pytest.fixture()
+def setup_unique_fk_tables(engine, sample_engine):
+    query = """
+    DROP SCHEMA IF EXISTS tmptest CASCADE;
+    CREATE SCHEMA tmptest;
+    CREATE TABLE IF NOT EXISTS tmptest.table_1
+    (
+        code TEXT NOT NULL UNIQUE,
+        foo  TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS tmptest.table_2
+    (
+        id           SERIAL PRIMARY KEY,
+        table_1_code TEXT REFERENCES tmptest.table_1 (code) ON DELETE CASCADE
+    );
+
+    CREATE TABLE IF NOT EXISTS tmptest.table_3
+    (
+        id           SERIAL PRIMARY KEY,
+        table_1_code TEXT REFERENCES tmptest.table_1 (code) ON DELETE CASCADE
+    );
+    """
+    engine.execute(query)
+    engine.execute(
+        "INSERT INTO tmptest.table_1 (code, foo) SELECT 'code-' || i, 'foo-' || i FROM generate_series(1, 10) i"
+    )
+    engine.execute("INSERT INTO tmptest.table_2 (id, table_1_code) VALUES (0, 'code-1')")
+    engine.execute("INSERT INTO tmptest.table_3 (id, table_1_code) VALUES (0, 'code-1')")
+    engine.commit()
+
+    sample_engine.execute(query)
+    sample_engine.commit()
+
+
 @pytest.mark.parametrize(
     "patch_scenario, sample_size, expected",
     [
@@ -302,6 +442,26 @@ def test_create_tmp_tables(
     # assert False
 
 
+@pytest.mark.usefixtures("setup_test_db", "setup_sample_tables", "setup_identity_tables")
+def test_create_tmp_tables_identity_pk(loop, aengine, apool):
+    from padmy.sampling.sampling import create_temp_tables
+    from padmy.db import Database
+
+    db = Database(name=PG_DATABASE)
+
+    async def test():
+        await db.explore(apool, ["tmptest"])
+        for table in db.tables:
+            table.sample_size = 0 if table.table == "table_1" else 100
+
+        async with aengine.transaction():
+            await create_temp_tables(aengine, tables=db.tables)
+            return [dict(_item) for _item in await aengine.fetch("SELECT foo FROM _tmptest_table_1_tmp")]
+
+    data = loop.run_until_complete(test())
+    assert data == [{"foo": "foo-1"}]
+
+
 @pytest.mark.usefixtures("setup_test_db", "setup_2_simple_tables")
 def test_sample_database_simple(loop, apool, sample_engine):
     from padmy.sampling import sample_database
@@ -326,7 +486,6 @@ def test_sample_database_simple(loop, apool, sample_engine):
                 conn=conn,
                 target_conn=target_conn,
                 show_progress=False,
-                chunk_size=1,
                 db=db,
                 no_trigger=False,
             )
@@ -374,7 +533,6 @@ def test_sample_database(loop, apool, sample_engine):
                 conn=conn,
                 target_conn=target_conn,
                 show_progress=False,
-                chunk_size=1,
                 db=db,
                 no_trigger=False,
             )
@@ -388,3 +546,188 @@ def test_sample_database(loop, apool, sample_engine):
     assert len(data) == 1
     data = fetch_all(sample_engine, "SELECT * FROM public.table_1")
     assert len(data) == 1
+
+
+@pytest.mark.usefixtures(
+    "setup_test_db",
+    "setup_tables",
+    "populate_data",
+    "setup_sample_db",
+    "setup_sample_tables",
+)
+def test_sample_database_pool(loop, apool, sample_engine):
+    from padmy.sampling import sample_database
+    from padmy.db import Database
+    from padmy.config import Config, ConfigSchema, ConfigTable
+
+    db = Database(name=PG_DATABASE)
+    config = Config(
+        sample=100.0,
+        schemas=[ConfigSchema(schema="public")],
+        tables=[ConfigTable(schema="public", table="table_1", sample=0.0)],
+    )
+
+    async def test():
+        conn = await asyncpg.connect(f"{PG_URL}/{PG_DATABASE}")
+        target_pool = await asyncpg.create_pool(f"{PG_URL}/{PG_SAMPLE_DATABASE}", min_size=1, max_size=4)
+
+        try:
+            await db.explore(apool, ["public"])
+            db.load_config(config)
+            await sample_database(conn=conn, target_conn=target_pool, db=db, no_trigger=False)
+        finally:
+            await asyncio.wait_for(conn.close(), timeout=1)
+            await asyncio.wait_for(target_pool.close(), timeout=1)
+
+    loop.run_until_complete(test())
+
+    data = fetch_all(sample_engine, "SELECT * FROM public.table_2")
+    assert len(data) == 1
+    data = fetch_all(sample_engine, "SELECT * FROM public.table_1")
+    assert len(data) == 1
+
+
+@pytest.mark.parametrize(
+    "no_index, method",
+    [
+        pytest.param(True, "system_rows", id="no-index"),
+        pytest.param(False, "bernoulli", id="bernoulli"),
+        pytest.param(True, "bernoulli", id="no-index-bernoulli"),
+    ],
+)
+@pytest.mark.usefixtures("setup_test_db", "setup_2_simple_tables")
+def test_sample_database_options(loop, apool, sample_engine, no_index, method):
+    from padmy.sampling import sample_database
+    from padmy.db import Database
+    from padmy.config import Config, ConfigSchema, ConfigTable
+
+    sample_engine.execute("CREATE INDEX table_2_table_1_id_idx ON tmptest.table_2 (table_1_id)")
+    sample_engine.commit()
+
+    db = Database(name=PG_DATABASE)
+    config = Config(
+        sample=100.0,
+        schemas=[ConfigSchema(schema="tmptest")],
+        tables=[ConfigTable(schema="tmptest", table="table_1", sample=0.0)],
+    )
+
+    async def test():
+        conn = await asyncpg.connect(f"{PG_URL}/{PG_DATABASE}")
+        target_pool = await asyncpg.create_pool(f"{PG_URL}/{PG_SAMPLE_DATABASE}", min_size=1, max_size=4)
+
+        try:
+            await db.explore(apool, ["tmptest"])
+            db.load_config(config)
+            await sample_database(
+                conn=conn,
+                target_conn=target_pool,
+                db=db,
+                no_trigger=False,
+                no_index=no_index,
+                method=method,
+            )
+        finally:
+            await asyncio.wait_for(conn.close(), timeout=1)
+            await asyncio.wait_for(target_pool.close(), timeout=1)
+
+    loop.run_until_complete(test())
+
+    data = fetch_all(sample_engine, "SELECT * FROM tmptest.table_2")
+    assert len(data) == 1
+    data = fetch_all(sample_engine, "SELECT * FROM tmptest.table_1")
+    assert len(data) == 1
+    # The dropped indexes are recreated once the data is inserted
+    data = fetch_all(sample_engine, "SELECT indexname FROM pg_indexes WHERE schemaname = 'tmptest' ORDER BY indexname")
+    assert [x["indexname"] for x in data] == ["table_1_pkey", "table_2_pkey", "table_2_table_1_id_idx"]
+
+
+@pytest.mark.usefixtures("setup_test_db", "setup_identity_tables")
+def test_sample_database_identity_pk(loop, apool, sample_engine):
+    from padmy.sampling import sample_database
+    from padmy.db import Database
+    from padmy.config import Config, ConfigSchema, ConfigTable
+
+    db = Database(name=PG_DATABASE)
+    config = Config(
+        sample=100.0,
+        schemas=[ConfigSchema(schema="tmptest")],
+        tables=[ConfigTable(schema="tmptest", table="table_1", sample=0.0)],
+    )
+
+    async def test():
+        conn = await asyncpg.connect(f"{PG_URL}/{PG_DATABASE}")
+        target_conn = await asyncpg.connect(f"{PG_URL}/{PG_SAMPLE_DATABASE}")
+
+        try:
+            await db.explore(apool, ["tmptest"])
+            db.load_config(config)
+            await sample_database(conn=conn, target_conn=target_conn, db=db, no_trigger=False)
+        finally:
+            await asyncio.wait_for(conn.close(), timeout=1)
+            await asyncio.wait_for(target_conn.close(), timeout=1)
+
+    loop.run_until_complete(test())
+
+    data = fetch_all(sample_engine, "SELECT foo FROM tmptest.table_1")
+    assert data == [{"foo": "foo-1"}]
+    data = fetch_all(sample_engine, "SELECT * FROM tmptest.table_2")
+    assert len(data) == 1
+
+
+@pytest.mark.usefixtures("setup_test_db", "setup_enum_array_tables")
+def test_sample_database_enum_array(loop, apool, sample_engine):
+    from padmy.sampling import sample_database
+    from padmy.db import Database
+    from padmy.config import Config, ConfigSchema
+
+    db = Database(name=PG_DATABASE)
+    config = Config(sample=100.0, schemas=[ConfigSchema(schema="tmptest")], tables=[])
+
+    async def test():
+        conn = await asyncpg.connect(f"{PG_URL}/{PG_DATABASE}")
+        target_conn = await asyncpg.connect(f"{PG_URL}/{PG_SAMPLE_DATABASE}")
+
+        try:
+            await db.explore(apool, ["tmptest"])
+            db.load_config(config)
+            await sample_database(conn=conn, target_conn=target_conn, db=db, no_trigger=False)
+        finally:
+            await asyncio.wait_for(conn.close(), timeout=1)
+            await asyncio.wait_for(target_conn.close(), timeout=1)
+
+    loop.run_until_complete(test())
+
+    data = fetch_all(sample_engine, "SELECT id, moods::text[] AS moods FROM tmptest.table_1 ORDER BY id")
+    assert data == [{"id": 0, "moods": ["happy", "sad"]}, {"id": 1, "moods": ["sad"]}]
+
+
+@pytest.mark.usefixtures("setup_test_db", "setup_unique_fk_tables")
+def test_sample_database_unique_fk(loop, apool, sample_engine):
+    from padmy.sampling import sample_database
+    from padmy.db import Database
+    from padmy.config import Config, ConfigSchema, ConfigTable
+
+    db = Database(name=PG_DATABASE)
+    config = Config(
+        sample=100.0,
+        schemas=[ConfigSchema(schema="tmptest")],
+        tables=[ConfigTable(schema="tmptest", table="table_1", sample=0.0)],
+    )
+
+    async def test():
+        conn = await asyncpg.connect(f"{PG_URL}/{PG_DATABASE}")
+        target_conn = await asyncpg.connect(f"{PG_URL}/{PG_SAMPLE_DATABASE}")
+
+        try:
+            await db.explore(apool, ["tmptest"])
+            db.load_config(config)
+            await sample_database(conn=conn, target_conn=target_conn, db=db, no_trigger=False)
+        finally:
+            await asyncio.wait_for(conn.close(), timeout=1)
+            await asyncio.wait_for(target_conn.close(), timeout=1)
+
+    loop.run_until_complete(test())
+
+    # Both child tables reference the same row, which must only be inserted once
+    data = fetch_all(sample_engine, "SELECT code FROM tmptest.table_1")
+    assert data == [{"code": "code-1"}]